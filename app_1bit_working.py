@@ -3,10 +3,10 @@ import os
 import sys
 import time
 import logging
-import glob
 import json
-import requests
-from flask import Flask, jsonify, request, render_template
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, abort, jsonify, request, render_template, send_file, url_for
 from datetime import datetime
 from dotenv import load_dotenv
 from openai import OpenAI
@@ -30,120 +30,174 @@ examplesdir = os.path.join(epaper_root, 'examples')
 picdir = os.path.join(epaper_root, 'pic')
 images_dir = '/home/pi/rpi-screen/images'  # AI generated images directory
 metadata_file = '/home/pi/rpi-screen/image_metadata.json'  # Image descriptions/prompts
+generation_cache_file = '/home/pi/rpi-screen/generation_cache.json'  # Prompt -> images generated from it, shared with the quiz
+display_state_file = '/home/pi/rpi-screen/display_state.json'  # Hash of the frame on screen
+keep_originals = os.getenv('KEEP_ORIGINALS', '1') != '0'  # Keep downloaded originals next to the gallery images
+storage_quota_mb = float(os.getenv('STORAGE_QUOTA_MB', '1024'))  # Originals are evicted to keep images_dir under this
 
 if os.path.exists(libdir):
     sys.path.insert(0, libdir)
 if os.path.exists(examplesdir):
     sys.path.insert(0, examplesdir)
+# Fall back to this checkout's examples/ for shared modules not yet copied to the Pi
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'examples'))
 
 # Load environment variables and initialize OpenAI
 load_dotenv(os.path.join(examplesdir, '.env'))
 client = OpenAI(api_key=os.getenv("OPENAI_KEY")) if os.getenv("OPENAI_KEY") else None
 
-# Import e-Paper library (1-bit black and white)
-from waveshare_epd import epd2in7_V2
+# Import the e-Paper driver for the panel selected by EPD_PANEL; EPD_BACKEND=sim selects the simulator
+import epd_backend
+import panels
+panel = panels.get_profile()
+epd_driver = epd_backend.load_driver(panel.model)
 from PIL import Image, ImageDraw, ImageFont
+import image_pipeline
+from render_cache import RenderCache, render_mode
+from thumbnails import ThumbnailCache, FORMATS as THUMB_FORMATS
+from metadata_store import MetadataStore
+from generation_cache import GenerationCache, DEFAULT_TTL
+from jobs import Job, JobRegistry
+from display_worker import DisplayWorker, DisplayBusy
+from display_session import DisplaySession, MODE_FULL, MODE_4GRAY
+from refresh_planner import RefreshPlanner
+from gallery_index import GalleryIndex, cursor_for, parse_cursor
+from search_index import SearchIndex
+from rotation import ShuffleBag, FramePrefetcher
+from storage_quota import StorageQuota
+from download_client import DownloadClient
+import metrics
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
 
-# Global variable for EPD
-epd = None
+# The display worker thread owns the EPD; routes only submit jobs to it.
+# The panel stays initialized between jobs and sleeps after EPD_IDLE_TIMEOUT seconds.
+display_session = DisplaySession(epd_driver.EPD, idle_timeout=float(os.getenv('EPD_IDLE_TIMEOUT', '60')),
+                                 state_file=display_state_file, refresh=panel.refresh,
+                                 sleep_method=panel.sleep)
+job_registry = JobRegistry()
 
-def init_display():
-    global epd
-    try:
-        if epd is None:
-            epd = epd2in7_V2.EPD()
-        logger.info("Initializing display...")
-        epd.init()
-        logger.info("Display initialized successfully")
-        return True
-    except Exception as e:
-        logger.error(f'Failed to initialize display: {e}')
-        return False
+# Diffs 1-bit frames against what is on screen to pick partial, fast or full refreshes
+refresh_planner = RefreshPlanner(panel.width, panel.height, modes=panel.refresh.keys())
 
-def cleanup_display():
-    global epd
-    try:
-        if epd:
-            logger.info("Putting display to sleep...")
-            epd.sleep()
-            logger.info("Display sleep completed")
-    except Exception as e:
-        logger.error(f'Error during cleanup: {e}')
+def forget_screen(session):
+    # A failed job may have left a partial frame on the panel, so neither the
+    # saved frame hash nor the planner's last frame can be trusted any more
+    session.forget_frame()
+    refresh_planner.invalidate()
 
-def init_display_4gray():
-    """Initialize display for 4-bit grayscale mode (for pre-made bitmaps)"""
-    global epd
-    try:
-        if epd is None:
-            epd = epd2in7_V2.EPD()
-        logger.info("Initializing display for 4-bit grayscale...")
-        epd.Init_4Gray()
-        logger.info("4-bit grayscale display initialized successfully")
-        return True
-    except Exception as e:
-        logger.error(f'Failed to initialize 4-bit display: {e}')
-        return False
+display_worker = DisplayWorker(display_session, maxsize=8, registry=job_registry, on_error=forget_screen)
+display_worker.start()
 
-def display_image_4bit(filepath):
-    """Display a 4-level grayscale bitmap image (works with pre-made bitmaps)"""
-    logger.info(f"Displaying 4-bit image: {filepath}")
-    try:
-        init_display_4gray()
-        
-        # Load and process image
-        img = Image.open(filepath).convert('L')  # Convert to grayscale
-        img = img.resize((epd.height, epd.width))  # Note: height x width for landscape
-        
-        # Map to 4 grayscale levels: 0, 85, 170, 255 (Harry Potter quiz technique)
-        logger.info("Applying 4-level grayscale mapping...")
-        img = img.point(lambda x: 0 if x < 64 else 85 if x < 128 else 170 if x < 192 else 255, 'L')
-        
-        # Display using 4-bit grayscale mode
-        logger.info("Displaying 4-bit grayscale image...")
-        epd.display_4Gray(epd.getbuffer_4Gray(img))
-        logger.info("4-bit image display completed")
-        
-        time.sleep(2)
-        cleanup_display()
-        return True
-        
-    except Exception as e:
-        logger.error(f"Error displaying 4-bit image: {e}")
-        return False
+# Image generation (DALL-E call, download, processing) runs off the request thread
+generation_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='generate')
 
-def load_image_metadata():
-    """Load image metadata from JSON file"""
-    try:
-        if os.path.exists(metadata_file):
-            with open(metadata_file, 'r') as f:
-                return json.load(f)
-        else:
-            return {}
-    except Exception as e:
-        logger.error(f"Error loading metadata: {e}")
-        return {}
+# Pooled keep-alive session with timeouts for downloading generated images
+download_client = DownloadClient(pool_size=2)
+
+# Panel-ready packed buffers for gallery images, filled on generation or first display
+render_cache = RenderCache(os.path.join(images_dir, '.cache'), panel)
+
+# Gallery images newest first, scanned once and then kept current with inotify
+gallery_index = GalleryIndex(images_dir)
+gallery_index.start()
+
+# Image descriptions, shared with the quiz and pack_gallery.py through a file lock
+metadata_store = MetadataStore(metadata_file)
+
+# Prompt -> generated images; a prompt seen before reuses one of its images as
+# GENERATION_CACHE_POLICY allows, here and in the quiz
+generation_cache = GenerationCache(metadata_store, images_dir, path=generation_cache_file,
+                                   policy=os.getenv('GENERATION_CACHE_POLICY', 'random'),
+                                   ttl=float(os.getenv('GENERATION_CACHE_TTL', DEFAULT_TTL)))
+
+# Full-text search over those descriptions for /images/list?q=
+search_index = SearchIndex(metadata_store)
+
+# WebP/PNG previews for the gallery page, made on first request
+thumbnail_cache = ThumbnailCache(os.path.join(images_dir, '.cache', 'thumbs'))
 
-def save_image_metadata(metadata):
-    """Save image metadata to JSON file"""
+# Evicts least recently used originals and intermediates once images_dir passes the quota
+storage_quota = StorageQuota(images_dir, int(storage_quota_mb * 2**20), cache_dir=render_cache.cache_dir,
+                             is_referenced=metadata_store.__contains__)
+storage_quota.scan()
+
+def submit_display_job(kind, fn, *args, message=''):
+    """Queue a render function on the display worker and return a 202 response"""
     try:
-        with open(metadata_file, 'w') as f:
-            json.dump(metadata, f, indent=2)
-        return True
-    except Exception as e:
-        logger.error(f"Error saving metadata: {e}")
-        return False
+        job = display_worker.submit(kind, fn, *args, description=message)
+    except DisplayBusy as e:
+        logger.warning(f"Rejected {kind} job: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    return jsonify({'status': 'queued', 'message': message, 'job_id': job.id}), 202
+
+def init_display(session):
+    session.acquire(MODE_FULL)
+
+def cleanup_display(session):
+    session.sleep()
+
+def requested_render_mode(data):
+    """Render mode from the optional 'depth' (4gray/1bit) and 'dither' fields of a request"""
+    mode = render_mode(data.get('depth', panel.default_depth), data.get('dither', 'none'))
+    if not panel.supports(mode):
+        raise ValueError(f"{panel.model} cannot show {mode} images (depths: {', '.join(panel.depths)})")
+    return mode
+
+def packed_buffer(filepath, mode):
+    """Packed panel buffer for a gallery image from the render cache (resized, reduced
+    to the panel's levels or palette and packed). Panels larger than the gallery images
+    render from the kept original when there is one."""
+    source = image_pipeline.rendition_source(filepath, panel.display_size)
+    if source != filepath:
+        storage_quota.touch(source)
+    return render_cache.get(source, mode)
+
+# /images/random walks a shuffled round of the gallery; the frame after the one
+# on screen is packed in the background so showing it costs only SPI and refresh
+shuffle_bag = ShuffleBag(gallery_index)
+frame_prefetcher = FramePrefetcher(packed_buffer)
+upcoming = shuffle_bag.peek()
+if upcoming is not None:
+    frame_prefetcher.prefetch(upcoming.path, render_mode(panel.default_depth))
+
+def display_image(session, filepath, mode='4gray', buf=None):
+    """Display a gallery image in a render mode from render_cache.RENDERERS"""
+    logger.info(f"Displaying image ({mode}): {filepath}")
+    
+    if buf is None:
+        logger.info("Loading packed panel buffer...")
+        buf = packed_buffer(filepath, mode)
+    result = {'filename': os.path.basename(filepath), 'mode': mode}
+    
+    if mode.startswith('1bit'):
+        # Black and white frames go through the planner, so similar images refresh partially
+        result['refresh'] = refresh_planner.show(session, buf)
+        return result
+    
+    depth = mode.split('-', 1)[0]
+    refresh_planner.invalidate()
+    if session.already_showing(depth, buf):
+        logger.info("Image already on screen, skipping refresh")
+        result['refresh'] = 'none'
+        return result
+    
+    # Display using 4-bit grayscale mode, or the color panel's palette buffer
+    logger.info(f"Displaying {depth} image...")
+    session.show(MODE_4GRAY if depth == '4gray' else MODE_FULL, buf)
+    session.mark_showing(depth, buf)
+    logger.info(f"{depth} image display completed")
+    result['refresh'] = 'full'
+    return result
 
 def get_image_description(filename):
     """Get description for an image, with fallbacks"""
-    metadata = load_image_metadata()
-    
     # Check if we have a specific description
-    if filename in metadata:
-        return metadata[filename]
+    description = metadata_store.get(filename)
+    if description is not None:
+        return description
     
     # Generate a default description based on timestamp and type
     if 'ai_hp' in filename:
@@ -182,30 +236,44 @@ def get_image_description(filename):
     return "AI-generated artwork"
 
 def update_image_metadata(filename, description):
-    """Update description for a specific image"""
-    metadata = load_image_metadata()
-    metadata[filename] = description
-    return save_image_metadata(metadata)
-
-def generate_image_from_prompt(prompt):
-    """Generate image from user prompt using OpenAI DALL-E"""
+    """Update description for a specific image; written to disk with other updates shortly after"""
+    metadata_store.set(filename, description)
+    return True
+
+def generate_image_from_prompt(prompt, progress=None, mode='4gray', reuse=True):
+    """Generate image from user prompt using OpenAI DALL-E
+
+    progress, if given, is called as progress(stage, message) before each step.
+    The panel buffer for the given render mode is cached along with the image.
+    If reuse is set, a gallery image made from the same prompt is returned
+    instead when the generation cache policy allows it.
+    """
+    progress = progress or (lambda stage, message: None)
+    cached = generation_cache.lookup(prompt) if reuse else None
+    if cached:
+        filename = os.path.basename(cached)
+        progress('cache', f'Reusing {filename}, made from the same prompt')
+        return cached, filename
     if not client:
         raise Exception("OpenAI client not initialized. Check API key in .env file.")
     
     logger.info(f"Generating image with prompt: {prompt}")
     
-    # Generate timestamp for unique filename
+    # Timestamp plus a random part, so jobs started in the same second don't share a filename
     timestamp = time.strftime("%Y%m%d_%H%M%S")
-    base_filename = f"ai_custom_{timestamp}"
+    base_filename = f"ai_custom_{timestamp}_{uuid.uuid4().hex[:8]}"
     
-    # File paths for processing pipeline
-    original_path = os.path.join(images_dir, f"{base_filename}.bmp")
-    cropped_path = os.path.join(images_dir, f"{base_filename}_crop.bmp")
+    # Only the display-sized image is written; the original is kept compressed if enabled
+    original_base = os.path.join(images_dir, base_filename) if keep_originals else None
     resized_path = os.path.join(images_dir, f"{base_filename}_resized.bmp")
+    resized_filename = os.path.basename(resized_path)
+    original_path = None
+    recorded = False
     
     try:
         # Step 1: Generate image with OpenAI DALL-E
         logger.info("Requesting image from OpenAI DALL-E...")
+        progress('request', 'Requesting image from OpenAI DALL-E')
         response = client.images.generate(
             model="dall-e-3",
             prompt=f"Illustration about '{prompt}', minimal colors, minimalistic, reduce small details.",
@@ -216,238 +284,218 @@ def generate_image_from_prompt(prompt):
         
         # Step 2: Download the image
         logger.info("Downloading generated image...")
+        progress('download', 'Downloading generated image')
         image_url = response.data[0].url
-        img_data = requests.get(image_url).content
-        
-        with open(original_path, 'wb') as f:
-            f.write(img_data)
-        logger.info(f"Image saved to {original_path}")
+        img_data = download_client.fetch(image_url)
         
-        # Step 3: Crop to 3:2 aspect ratio (same as Harry Potter quiz)
-        logger.info("Cropping image to 3:2 aspect ratio...")
-        crop_image_3_2(original_path, cropped_path)
+        # Step 3: Decode once, crop to 3:2 and resize to display dimensions in memory
+        logger.info("Cropping and resizing image for e-Paper display...")
+        progress('process', 'Cropping and resizing image for e-Paper display')
+        display_img, sha1, original_path = image_pipeline.process_download(
+            img_data, resized_path, original_base)
         
-        # Step 4: Resize to display dimensions
-        logger.info("Resizing image for e-Paper display...")
-        resize_image_for_display(cropped_path, resized_path)
-        
-        # Step 5: Save the user's prompt as the image description
+        # Step 4: Save the user's prompt as the image description
         logger.info("Saving image metadata...")
-        resized_filename = os.path.basename(resized_path)
+        progress('metadata', 'Saving image metadata')
+        recorded = True
         update_image_metadata(resized_filename, prompt)
+        generation_cache.record(prompt, resized_filename)
+        
+        # Step 5: Pack the panel buffer from the in-memory image so displaying it is instant
+        source = image_pipeline.rendition_source(resized_path, panel.display_size)
+        if source == resized_path:
+            render_cache.store(resized_path, mode, render_cache.render(display_img, mode), sha1)
+        else:
+            render_cache.get(source, mode)
+        
+        # List it right away rather than waiting for the watcher to see it
+        gallery_index.update(resized_filename)
+        
+        # Make room for it by evicting old originals if the images are over the quota
+        storage_quota.add(resized_path)
+        storage_quota.add(original_path)
+        storage_quota.enforce()
         
         logger.info(f"Image generation complete: {resized_filename}")
         return resized_path, resized_filename
         
     except Exception as e:
-        # Clean up partial files on error
-        for path in [original_path, cropped_path, resized_path]:
-            if os.path.exists(path):
+        # Clean up partial files on error, and the records pointing at them
+        for path in [original_path, resized_path]:
+            if path and os.path.exists(path):
                 try:
                     os.remove(path)
                 except:
                     pass
+        if recorded:
+            metadata_store.delete(resized_filename)
+            generation_cache.forget(resized_filename)
+            gallery_index.update(resized_filename)
         raise e
 
-def crop_image_3_2(filepath, filepath_new):
-    """Crop image to 3:2 aspect ratio (from image_generator.py)"""
-    logger.info("Cropping image to 3:2 aspect ratio...")
-    img = Image.open(filepath)
-    width, height = img.size
-    target_ratio = 3 / 2  # width / height
-    current_ratio = width / height
-
-    if current_ratio > target_ratio:
-        # Image is too wide → crop width
-        new_width = int(height * target_ratio)
-        left = (width - new_width) / 2
-        top = 0
-        right = left + new_width
-        bottom = height
-    else:
-        # Image is too tall or square → crop height
-        new_height = int(width / target_ratio)
-        top = (height - new_height) / 2
-        left = 0
-        right = width
-        bottom = top + new_height
-
-    img_cropped = img.crop((left, top, right, bottom))
-    img_cropped.save(filepath_new)
-    logger.info(f"Image cropped and saved to {filepath_new}")
-
-def resize_image_for_display(filepath, filepath_new):
-    """Resize image to fit e-Paper display: 264x176 pixels (from image_generator.py)"""
-    logger.info("Resizing image for e-Paper display...")
-    img = Image.open(filepath)
-    img_resized = img.resize((264, 176), Image.LANCZOS)  # Updated to use LANCZOS
-    img_resized.save(filepath_new)
-    logger.info(f"Image resized to 264x176 and saved to {filepath_new}")
-
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', depths=panel.depths)
+
+def render_clear(session):
+    if session.already_showing('1bit', refresh_planner.white_frame()):
+        logger.info("Display already clear, skipping refresh")
+        return {'refresh': 'none'}
+    epd = session.acquire(MODE_FULL)
+    logger.info("Executing epd.Clear()...")
+    epd.Clear()
+    refresh_planner.cleared(session)
+    logger.info("Clear operation completed")
+    return {'refresh': 'full'}
 
 @app.route('/clear')
 def clear_display():
     logger.info("Clear display requested")
-    try:
-        init_display()
-        logger.info("Executing epd.Clear()...")
-        epd.Clear()
-        logger.info("Clear operation completed")
-        cleanup_display()
-        return jsonify({'status': 'success', 'message': 'Display cleared'})
-    except Exception as e:
-        logger.error(f"Clear display error: {e}")
-        return jsonify({'status': 'error', 'message': str(e)})
+    return submit_display_job('clear', render_clear, message='Clearing display')
+
+def render_test_pattern(session):
+    epd = session.driver()
+    
+    # Create 1-bit black and white image
+    logger.info("Creating 1-bit image...")
+    image = Image.new('1', (epd.width, epd.height), 1)  # 1-bit mode, 1=white background
+    draw = ImageDraw.Draw(image)
+    
+    # Draw test pattern with black shapes (0=black, 1=white)
+    logger.info("Drawing test pattern...")
+    draw.rectangle((10, 10, 60, 60), fill=0)     # Black square
+    draw.rectangle((70, 10, 120, 60), fill=0)    # Black square
+    draw.rectangle((130, 10, 180, 60), fill=0)   # Black square
+    draw.rectangle((190, 10, 240, 60), fill=0)   # Black square
+    
+    draw.line((10, 80, 240, 80), fill=0, width=3)  # Black line
+    draw.text((10, 100), 'Test Pattern - 1-bit B&W', fill=0)
+    
+    # Use 1-bit display function (not 4-bit grayscale)
+    logger.info("Displaying 1-bit image...")
+    refresh = refresh_planner.show(session, epd.getbuffer(image))
+    logger.info("Display operation completed")
+    return {'refresh': refresh}
 
 @app.route('/test')
 def test_pattern():
     logger.info("Test pattern requested")
+    return submit_display_job('test', render_test_pattern, message='Test pattern queued')
+
+def render_hello_world(session):
+    epd = session.driver()
+    
+    logger.info("Creating 1-bit image for hello world...")
+    image = Image.new('1', (epd.width, epd.height), 1)  # 1-bit mode
+    draw = ImageDraw.Draw(image)
+    
     try:
-        init_display()
-        
-        # Create 1-bit black and white image
-        logger.info("Creating 1-bit image...")
-        image = Image.new('1', (epd.width, epd.height), 1)  # 1-bit mode, 1=white background
-        draw = ImageDraw.Draw(image)
-        
-        # Draw test pattern with black shapes (0=black, 1=white)
-        logger.info("Drawing test pattern...")
-        draw.rectangle((10, 10, 60, 60), fill=0)     # Black square
-        draw.rectangle((70, 10, 120, 60), fill=0)    # Black square
-        draw.rectangle((130, 10, 180, 60), fill=0)   # Black square
-        draw.rectangle((190, 10, 240, 60), fill=0)   # Black square
-        
-        draw.line((10, 80, 240, 80), fill=0, width=3)  # Black line
-        draw.text((10, 100), 'Test Pattern - 1-bit B&W', fill=0)
-        
-        # Use 1-bit display function (not 4-bit grayscale)
-        logger.info("Displaying image with epd.display()...")
-        epd.display(epd.getbuffer(image))
-        logger.info("Display operation completed")
-        cleanup_display()
-        return jsonify({'status': 'success', 'message': 'Test pattern displayed'})
-    except Exception as e:
-        logger.error(f"Test pattern error: {e}")
-        return jsonify({'status': 'error', 'message': str(e)})
+        font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 24)
+        logger.info("Loaded TrueType font")
+    except:
+        font = ImageFont.load_default()
+        logger.info("Using default font")
+    
+    logger.info("Drawing hello world text...")
+    draw.text((10, 10), 'Hello World!', font=font, fill=0)
+    draw.text((10, 50), 'E-Paper Display', font=font, fill=0)
+    draw.text((10, 90), '1-bit Black & White', font=font, fill=0)
+    
+    logger.info("Displaying hello world image...")
+    refresh = refresh_planner.show(session, epd.getbuffer(image))
+    logger.info("Hello world display completed")
+    return {'refresh': refresh}
 
 @app.route('/hello')
 def hello_world():
     logger.info("Hello world requested")
+    return submit_display_job('hello', render_hello_world, message='Hello World queued')
+
+def render_time(session):
+    epd = session.driver()
+    
+    logger.info("Creating 1-bit image for time...")
+    image = Image.new('1', (epd.width, epd.height), 1)
+    draw = ImageDraw.Draw(image)
+    
     try:
-        init_display()
-        
-        logger.info("Creating 1-bit image for hello world...")
-        image = Image.new('1', (epd.width, epd.height), 1)  # 1-bit mode
-        draw = ImageDraw.Draw(image)
-        
-        try:
-            font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 24)
-            logger.info("Loaded TrueType font")
-        except:
-            font = ImageFont.load_default()
-            logger.info("Using default font")
-        
-        logger.info("Drawing hello world text...")
-        draw.text((10, 10), 'Hello World!', font=font, fill=0)
-        draw.text((10, 50), 'E-Paper Display', font=font, fill=0)
-        draw.text((10, 90), '1-bit Black & White', font=font, fill=0)
-        
-        logger.info("Displaying hello world image...")
-        epd.display(epd.getbuffer(image))
-        logger.info("Hello world display completed")
-        cleanup_display()
-        return jsonify({'status': 'success', 'message': 'Hello World displayed'})
-    except Exception as e:
-        logger.error(f"Hello world error: {e}")
-        return jsonify({'status': 'error', 'message': str(e)})
+        font_large = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 36)
+        font_small = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 18)
+        logger.info("Loaded TrueType fonts")
+    except:
+        font_large = ImageFont.load_default()
+        font_small = ImageFont.load_default()
+        logger.info("Using default fonts")
+    
+    # Render the time when the job runs, not when it was queued
+    current_time = datetime.now()
+    time_str = current_time.strftime('%H:%M:%S')
+    date_str = current_time.strftime('%Y-%m-%d')
+    
+    logger.info(f"Drawing time: {time_str} {date_str}")
+    draw.text((20, 30), time_str, font=font_large, fill=0)
+    draw.text((30, 80), date_str, font=font_small, fill=0)
+    
+    logger.info("Displaying time image...")
+    refresh = refresh_planner.show(session, epd.getbuffer(image))
+    logger.info("Time display completed")
+    return {'refresh': refresh}
 
 @app.route('/time')
 def display_time():
     logger.info("Time display requested")
+    return submit_display_job('time', render_time, message='Time display queued')
+
+def render_text(session, text):
+    epd = session.driver()
+    
+    image = Image.new('1', (epd.width, epd.height), 1)
+    draw = ImageDraw.Draw(image)
+    
     try:
-        init_display()
-        
-        logger.info("Creating 1-bit image for time...")
-        image = Image.new('1', (epd.width, epd.height), 1)
-        draw = ImageDraw.Draw(image)
-        
-        try:
-            font_large = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 36)
-            font_small = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 18)
-            logger.info("Loaded TrueType fonts")
-        except:
-            font_large = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-            logger.info("Using default fonts")
-        
-        current_time = datetime.now()
-        time_str = current_time.strftime('%H:%M:%S')
-        date_str = current_time.strftime('%Y-%m-%d')
-        
-        logger.info(f"Drawing time: {time_str} {date_str}")
-        draw.text((20, 30), time_str, font=font_large, fill=0)
-        draw.text((30, 80), date_str, font=font_small, fill=0)
-        
-        logger.info("Displaying time image...")
-        epd.display(epd.getbuffer(image))
-        logger.info("Time display completed")
-        cleanup_display()
-        return jsonify({'status': 'success', 'message': 'Time displayed'})
-    except Exception as e:
-        logger.error(f"Time display error: {e}")
-        return jsonify({'status': 'error', 'message': str(e)})
+        font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 18)
+    except:
+        font = ImageFont.load_default()
+    
+    # Simple text wrapping
+    words = text.split(' ')
+    lines = []
+    current_line = ''
+    
+    for word in words:
+        test_line = current_line + ' ' + word if current_line else word
+        bbox = draw.textbbox((0, 0), test_line, font=font)
+        if bbox[2] > epd.width - 20:
+            if current_line:
+                lines.append(current_line)
+                current_line = word
+            else:
+                lines.append(word)
+        else:
+            current_line = test_line
+    
+    if current_line:
+        lines.append(current_line)
+    
+    # Draw lines
+    y = 10
+    for line in lines[:8]:  # Max 8 lines
+        draw.text((10, y), line, font=font, fill=0)
+        y += 25
+    
+    logger.info("Displaying custom text image...")
+    refresh = refresh_planner.show(session, epd.getbuffer(image))
+    logger.info("Custom text display completed")
+    return {'refresh': refresh}
 
 @app.route('/text', methods=['POST'])
 def display_text():
     logger.info("Custom text display requested")
     try:
-        init_display()
-        
         text = request.json.get('text', 'No text provided')
         logger.info(f"Displaying custom text: {text[:50]}...")
-        
-        image = Image.new('1', (epd.width, epd.height), 1)
-        draw = ImageDraw.Draw(image)
-        
-        try:
-            font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 18)
-        except:
-            font = ImageFont.load_default()
-        
-        # Simple text wrapping
-        words = text.split(' ')
-        lines = []
-        current_line = ''
-        
-        for word in words:
-            test_line = current_line + ' ' + word if current_line else word
-            bbox = draw.textbbox((0, 0), test_line, font=font)
-            if bbox[2] > epd.width - 20:
-                if current_line:
-                    lines.append(current_line)
-                    current_line = word
-                else:
-                    lines.append(word)
-            else:
-                current_line = test_line
-        
-        if current_line:
-            lines.append(current_line)
-        
-        # Draw lines
-        y = 10
-        for line in lines[:8]:  # Max 8 lines
-            draw.text((10, y), line, font=font, fill=0)
-            y += 25
-        
-        logger.info("Displaying custom text image...")
-        epd.display(epd.getbuffer(image))
-        logger.info("Custom text display completed")
-        cleanup_display()
-        return jsonify({'status': 'success', 'message': f'Displayed: {text[:50]}...' if len(text) > 50 else f'Displayed: {text}'})
+        message = f'Displaying: {text[:50]}...' if len(text) > 50 else f'Displaying: {text}'
+        return submit_display_job('text', render_text, text, message=message)
     except Exception as e:
         logger.error(f"Custom text error: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
@@ -455,95 +503,166 @@ def display_text():
 @app.route('/sleep')
 def sleep_display():
     logger.info("Sleep display requested")
-    try:
-        cleanup_display()
-        return jsonify({'status': 'success', 'message': 'Display sleeping'})
-    except Exception as e:
-        logger.error(f"Sleep error: {e}")
-        return jsonify({'status': 'error', 'message': str(e)})
+    return submit_display_job('sleep', cleanup_display, message='Display going to sleep')
 
 @app.route('/wake')
 def wake_display():
     logger.info("Wake display requested")
-    try:
-        init_display()
-        return jsonify({'status': 'success', 'message': 'Display awake'})
-    except Exception as e:
-        logger.error(f"Wake error: {e}")
-        return jsonify({'status': 'error', 'message': str(e)})
+    return submit_display_job('wake', init_display, message='Waking display')
+
+def run_quiz_intro(session):
+    # The quiz drives the panel through its own EPD object, so it runs as a
+    # display job to keep it from overlapping with other refreshes. Hand the
+    # panel over asleep; the quiz re-initializes it itself.
+    session.sleep()
+    session.forget_frame()
+    refresh_planner.invalidate()
+    os.chdir(examplesdir)
+    import helper_quiz as hq
+    
+    # Initialize and start quiz
+    hpq = hq.quizGame()
+    hpq.topic = 'Harry Potter'
+    hpq.question_count = 4
+    hpq.difficulty = 'medium'
+    
+    # Show the intro image; it is only generated the first time (see GENERATION_CACHE_POLICY)
+    topic = 'Harry Potter magical castle with wizards'
+    imagepath = hpq.generate_4bit_image(topic)
+    hpq.display_image_4bit(imagepath)
 
 @app.route('/quiz/start')
 def start_quiz():
     logger.info("Harry Potter quiz requested")
-    try:
-        # Import quiz module
-        os.chdir(examplesdir)
-        import helper_quiz as hq
-        
-        # Initialize and start quiz
-        hpq = hq.quizGame()
-        hpq.topic = 'Harry Potter'
-        hpq.question_count = 4
-        hpq.difficulty = 'medium'
-        
-        # Generate and show intro image
-        topic = 'Harry Potter magical castle with wizards'
-        imagepath = hpq.generate_4bit_image(topic)
-        hpq.display_image_4bit(imagepath)
-        
-        return jsonify({'status': 'success', 'message': 'Quiz started'})
-    except Exception as e:
-        logger.error(f"Quiz error: {e}")
-        return jsonify({'status': 'error', 'message': str(e)})
+    return submit_display_job('quiz', run_quiz_intro, message='Quiz starting')
+
+@app.route('/storage', methods=['GET', 'POST'])
+def storage_status():
+    """Report images_dir usage against the quota; POST evicts down to the quota now"""
+    result = {'status': 'success'}
+    if request.method == 'POST':
+        reclaimed, evicted = storage_quota.enforce()
+        result.update(reclaimed=reclaimed, evicted=evicted)
+    result.update(storage_quota.usage())
+    return jsonify(result)
+
+@app.route('/metrics')
+def metrics_report():
+    """Counters and timings recorded by the app (download throughput, ...)"""
+    return jsonify({'status': 'success', **metrics.REGISTRY.snapshot()})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the progress of a display or generation job"""
+    job = job_registry.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    return jsonify({'status': 'success', 'job': job.to_dict()})
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream a job's stage-by-stage progress as server-sent events"""
+    job = job_registry.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    
+    def stream():
+        index = 0
+        while True:
+            events = job.events_since(index, timeout=15)
+            for event in events:
+                yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+            index += len(events)
+            if job.done and index >= len(job.events):
+                yield f"event: end\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/images/list')
 def list_images():
-    """List all available AI-generated images with descriptions"""
+    """List AI-generated images with descriptions, newest first, one page at a time.
+    
+    Query parameters: limit (default 50, at most 200), cursor (next_cursor of the
+    previous page) and q (only images whose description matches every word).
+    """
     logger.info("Image list requested")
     try:
         if not os.path.exists(images_dir):
             return jsonify({'status': 'error', 'message': 'Images directory not found'})
         
-        # Find all resized AI images (Harry Potter and custom generated)
-        hp_pattern = os.path.join(images_dir, 'ai_hp*resized*.bmp')
-        custom_pattern = os.path.join(images_dir, 'ai_custom*resized*.bmp')
-        
-        image_files = glob.glob(hp_pattern) + glob.glob(custom_pattern)
-        
-        # Sort by modification time (newest first)
-        image_files.sort(key=os.path.getmtime, reverse=True)
+        try:
+            limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+            cursor = request.args.get('cursor')
+            after = parse_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)})
+        query = request.args.get('q', '').strip()
+        
+        # Resized AI images (Harry Potter and custom generated) from the index, newest first
+        include = search_index.search(query) if query else None
+        entries, more = gallery_index.page(after, limit, include)
+        total_count = gallery_index.count(include)
+        mode = render_mode(panel.default_depth)
         
         # Create image objects with metadata
         images_with_metadata = []
-        for filepath in image_files[:50]:  # Limit to 50 most recent
-            filename = os.path.basename(filepath)
-            description = get_image_description(filename)
-            
-            # Get file modification time for display
-            try:
-                mtime = os.path.getmtime(filepath)
-                from datetime import datetime
-                created_date = datetime.fromtimestamp(mtime).strftime('%m/%d/%Y %I:%M %p')
-            except:
-                created_date = 'Unknown'
-            
+        for entry in entries:
+            filename = entry.filename
             images_with_metadata.append({
                 'filename': filename,
-                'description': description,
-                'created': created_date
+                'description': get_image_description(filename),
+                'created': datetime.fromtimestamp(entry.mtime).strftime('%m/%d/%Y %I:%M %p'),
+                'format': os.path.splitext(filename)[1][1:],
+                'kind': entry.kind,
+                'size': entry.size,
+                # Whether displaying it is a cache hit (no resize or packing needed)
+                'rendered': render_cache.has(image_pipeline.rendition_source(entry.path, panel.display_size), mode),
+                # Versioned by mtime so the browser can cache the preview for good
+                'thumb': url_for('image_thumbnail', filename=filename, v=int(entry.mtime))
             })
         
-        logger.info(f"Found {len(image_files)} images, returning {len(images_with_metadata)} with metadata")
+        logger.info(f"Found {total_count} images, returning {len(images_with_metadata)} with metadata")
         return jsonify({
             'status': 'success', 
-            'message': f'Found {len(image_files)} images',
+            'message': f'Found {total_count} images',
             'images': images_with_metadata,
-            'total_count': len(image_files)
+            'total_count': total_count,
+            'next_cursor': cursor_for(entries[-1]) if more else None
         })
     except Exception as e:
         logger.error(f"Error listing images: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
+@app.route('/images/thumb/<filename>')
+def image_thumbnail(filename):
+    """Compressed preview of a gallery image, with ETag/Last-Modified validators"""
+    filepath = os.path.join(images_dir, filename)
+    if filename.startswith('.') or not os.path.isfile(filepath):
+        abort(404)
+    
+    # WebP for browsers that ask for it, PNG otherwise
+    ext = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'png'
+    try:
+        thumb_path, etag = thumbnail_cache.get(filepath, ext)
+    except Exception as e:
+        logger.error(f"Error making preview of {filename}: {e}")
+        abort(500)
+    
+    # /images/list links to ?v=<mtime>, which names one version of the image for good;
+    # without it the browser revalidates every time and usually gets a 304
+    versioned = 'v' in request.args
+    response = send_file(thumb_path, mimetype=THUMB_FORMATS[os.path.splitext(thumb_path)[1][1:]][1],
+                         etag=etag, last_modified=os.path.getmtime(filepath),
+                         max_age=365 * 24 * 3600 if versioned else 0)
+    if versioned:
+        response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
+
 @app.route('/images/display', methods=['POST'])
 def display_selected_image():
     """Display a selected image from the gallery"""
@@ -563,18 +682,27 @@ def display_selected_image():
         if not os.path.abspath(filepath).startswith(os.path.abspath(images_dir)):
             return jsonify({'status': 'error', 'message': 'Invalid file path'})
         
-        # Display the image using 4-bit grayscale (works with pre-made bitmaps)
-        success = display_image_4bit(filepath)
+        try:
+            mode = requested_render_mode(data)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)})
         
-        if success:
-            return jsonify({'status': 'success', 'message': f'Displaying image: {filename}'})
-        else:
-            return jsonify({'status': 'error', 'message': 'Failed to display image'})
+        # Display the image in 4-bit grayscale unless the request picks another depth/dither
+        return submit_display_job('image', display_image, filepath, mode,
+                                  message=f'Displaying image: {filename}')
             
     except Exception as e:
         logger.error(f"Error displaying image: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
+def display_rotation_image(session, filepath, mode):
+    """Display an image of the random rotation, then start packing the one after it"""
+    result = display_image(session, filepath, mode, frame_prefetcher.take(filepath, mode))
+    upcoming = shuffle_bag.peek()
+    if upcoming is not None:
+        frame_prefetcher.prefetch(upcoming.path, mode)
+    return result
+
 @app.route('/images/random')
 def display_random_image():
     """Display a random image from the gallery"""
@@ -583,27 +711,15 @@ def display_random_image():
         if not os.path.exists(images_dir):
             return jsonify({'status': 'error', 'message': 'Images directory not found'})
         
-        # Find all resized AI images (Harry Potter and custom generated)
-        hp_pattern = os.path.join(images_dir, 'ai_hp*resized*.bmp')
-        custom_pattern = os.path.join(images_dir, 'ai_custom*resized*.bmp')
-        
-        image_files = glob.glob(hp_pattern) + glob.glob(custom_pattern)
-        
-        if not image_files:
+        # Next image of the shuffled rotation, so none repeats before all were shown
+        entry = shuffle_bag.draw()
+        if entry is None:
             return jsonify({'status': 'error', 'message': 'No images found'})
-        
-        # Select random image
-        import random
-        selected_file = random.choice(image_files)
-        filename = os.path.basename(selected_file)
+        filename = entry.filename
         
         # Display the image
-        success = display_image_4bit(selected_file)
-        
-        if success:
-            return jsonify({'status': 'success', 'message': f'Displaying random image: {filename}'})
-        else:
-            return jsonify({'status': 'error', 'message': 'Failed to display random image'})
+        return submit_display_job('image', display_rotation_image, entry.path, render_mode(panel.default_depth),
+                                  message=f'Displaying random image: {filename}')
             
     except Exception as e:
         logger.error(f"Error displaying random image: {e}")
@@ -642,42 +758,65 @@ def update_image_description():
         logger.error(f"Error updating image description: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
+def run_generation_job(job, prompt, display, mode='4gray', reuse=True):
+    """Background pipeline behind /generate_image and /generate_image_only"""
+    job.mark_running()
+    try:
+        image_path, filename = generate_image_from_prompt(prompt, progress=job.add_event, mode=mode, reuse=reuse)
+        result = {'filename': filename}
+        
+        if display:
+            # Hand the image to the display worker and wait for the refresh
+            job.add_event('display', 'Waiting for the e-Paper display')
+            display_job = display_worker.submit('image', display_image, image_path, mode,
+                                                description=f'Displaying: "{prompt}"', timeout=60)
+            display_job.wait()
+            if display_job.status == 'error':
+                raise Exception(f'Image generated but display failed: {display_job.error}')
+            result['display'] = display_job.result
+        
+        job.mark_success(result)
+        logger.info(f"Generation job {job.id} completed: {filename}")
+    except Exception as e:
+        logger.error(f"Error generating image: {e}")
+        job.mark_error(f'Generation failed: {str(e)}')
+
+def submit_generation_job(display):
+    """Validate the prompt and queue a generation job, returning 202 with its id"""
+    data = request.json
+    if not data or 'prompt' not in data:
+        return jsonify({'status': 'error', 'message': 'Prompt required'})
+    
+    prompt = data['prompt'].strip()
+    if not prompt:
+        return jsonify({'status': 'error', 'message': 'Please provide a valid prompt'})
+    
+    try:
+        mode = requested_render_mode(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+    
+    if not client:
+        return jsonify({'status': 'error', 'message': 'OpenAI API key not configured'})
+    
+    logger.info(f"Generating image for prompt: {prompt}")
+    job = job_registry.add(Job('generate', prompt))
+    # "reuse": false asks for a new image even if one was made from this prompt
+    generation_executor.submit(run_generation_job, job, prompt, display, mode, data.get('reuse', True) is not False)
+    
+    action = 'Generating and displaying' if display else 'Generating'
+    return jsonify({
+        'status': 'queued',
+        'message': f'{action}: "{prompt}"',
+        'job_id': job.id
+    }), 202
+
 @app.route('/generate_image', methods=['POST'])
 def generate_and_display_image():
     """Generate image from user prompt and display it on e-Paper"""
     logger.info("AI image generation requested")
     try:
-        data = request.json
-        if not data or 'prompt' not in data:
-            return jsonify({'status': 'error', 'message': 'Prompt required'})
-        
-        prompt = data['prompt'].strip()
-        if not prompt:
-            return jsonify({'status': 'error', 'message': 'Please provide a valid prompt'})
-        
-        if not client:
-            return jsonify({'status': 'error', 'message': 'OpenAI API key not configured'})
-        
-        logger.info(f"Generating image for prompt: {prompt}")
-        
-        # Generate, process, and save the image
-        image_path, filename = generate_image_from_prompt(prompt)
-        
-        # Display the generated image on e-Paper using 4-bit grayscale
-        success = display_image_4bit(image_path)
-        
-        if success:
-            return jsonify({
-                'status': 'success', 
-                'message': f'Generated and displayed: "{prompt}"',
-                'filename': filename
-            })
-        else:
-            return jsonify({
-                'status': 'error', 
-                'message': f'Image generated but display failed: {filename}'
-            })
-            
+        return submit_generation_job(display=True)
     except Exception as e:
         logger.error(f"Error generating image: {e}")
         return jsonify({'status': 'error', 'message': f'Generation failed: {str(e)}'})
@@ -687,26 +826,7 @@ def generate_image_only():
     """Generate image from prompt without displaying (for testing)"""
     logger.info("AI image generation (no display) requested")
     try:
-        data = request.json
-        if not data or 'prompt' not in data:
-            return jsonify({'status': 'error', 'message': 'Prompt required'})
-        
-        prompt = data['prompt'].strip()
-        if not prompt:
-            return jsonify({'status': 'error', 'message': 'Please provide a valid prompt'})
-        
-        if not client:
-            return jsonify({'status': 'error', 'message': 'OpenAI API key not configured'})
-        
-        # Generate and process the image (no display)
-        image_path, filename = generate_image_from_prompt(prompt)
-        
-        return jsonify({
-            'status': 'success',
-            'message': f'Image generated: "{prompt}"',
-            'filename': filename
-        })
-        
+        return submit_generation_job(display=False)
     except Exception as e:
         logger.error(f"Error generating image: {e}")
         return jsonify({'status': 'error', 'message': f'Generation failed: {str(e)}'})
@@ -718,6 +838,13 @@ if __name__ == '__main__':
         app.run(host='0.0.0.0', port=5000, debug=False)
     except KeyboardInterrupt:
         logger.info('Shutting down...')
-        cleanup_display()
-        if epd:
-            epd2in7_V2.epdconfig.module_exit(cleanup=True)
\ No newline at end of file
+        display_worker.stop()
+        frame_prefetcher.stop()
+        gallery_index.stop()
+        metadata_store.flush()
+        generation_cache.flush()
+        generation_executor.shutdown(wait=False)
+        download_client.close()
+        if display_session.epd:
+            cleanup_display(display_session)
+            epd_driver.epdconfig.module_exit(cleanup=True)
\ No newline at end of file
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+# atomic_file is one of the shared modules in examples/ next to this file;
+# add it here rather than relying on the importer to have set up sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'examples'))
+import atomic_file
+
+logger = logging.getLogger(__name__)
+
+# Init modes of the epd2in7_V2 controller
+MODE_FULL = 'full'        # epd.init()       - 1-bit full refresh
+MODE_FAST = 'fast'        # epd.init_Fast()  - 1-bit fast refresh
+MODE_4GRAY = '4gray'      # epd.Init_4Gray() - 4-level grayscale
+MODE_PARTIAL = 'partial'  # epd.init(), then display_Partial reprograms the waveform
+# Awake, but the controller may be half-way through a command sequence: the
+# next acquire re-initializes it, and it still needs to be put to sleep
+MODE_UNKNOWN = 'unknown'
+
+# Mode -> (init method, init args, display method) for epd2in7_V2; other
+# panels pass their own table (see examples/panels.py)
+DEFAULT_REFRESH = {
+    MODE_FULL: ('init', (), 'display_Base'),
+    MODE_FAST: ('init_Fast', (), 'display_Fast'),
+    MODE_PARTIAL: ('init', (), 'display_Partial'),
+    MODE_4GRAY: ('Init_4Gray', (), 'display_4Gray'),
+}
+
+
+class DisplaySession:
+    """Keeps the panel initialized between jobs.
+
+    acquire(mode) only runs the reset + init sequence when the requested mode
+    differs from the one the controller is already in, and the panel is put
+    to sleep once it has been idle for idle_timeout seconds instead of after
+    every refresh. Only the display worker thread should call into this.
+
+    The session also remembers a hash of the last frame shown (persisted to
+    state_file, since e-Paper keeps its image across restarts) so refreshes
+    that would not change the screen can be skipped.
+
+    refresh and sleep_method name the driver calls, as in a panels.py profile.
+    """
+
+    def __init__(self, epd_factory, idle_timeout=60, state_file=None, refresh=None, sleep_method='sleep'):
+        self.epd_factory = epd_factory
+        self.refresh = refresh or DEFAULT_REFRESH
+        self.sleep_method = sleep_method
+        self.idle_timeout = idle_timeout
+        self.state_file = state_file
+        self.epd = None
+        self.mode = None  # None means asleep
+        self.last_used = 0
+        self.frame_hash = self._load_frame_hash()
+
+    def driver(self):
+        """Return the EPD object without initializing the panel"""
+        if self.epd is None:
+            self.epd = self.epd_factory()
+        return self.epd
+
+    def acquire(self, mode):
+        """Return the EPD initialized for mode, re-initializing only if needed"""
+        self.driver()
+        if mode == MODE_PARTIAL and self.mode == MODE_FULL:
+            # display_Partial resets and reprograms the controller itself; it
+            # only needs the regular init to have run once
+            self.mode = mode
+        if self.mode != mode:
+            if mode not in self.refresh:
+                raise ValueError(f"Display mode not supported by this panel: {mode}")
+            logger.info(f"Initializing display for {mode} mode (was {self.mode or 'asleep'})...")
+            init, init_args, _ = self.refresh[mode]
+            getattr(self.epd, init)(*init_args)
+            self.mode = mode
+        self.last_used = time.time()
+        return self.epd
+
+    def show(self, mode, buf, *args):
+        """Push a packed buffer with the display call for mode, initializing as needed"""
+        epd = self.acquire(mode)
+        getattr(epd, self.refresh[mode][2])(buf, *args)
+
+    def invalidate(self):
+        """Forget the current mode so the next acquire re-initializes the panel.
+        The panel is still treated as awake, so the idle timer puts it to sleep."""
+        if self.epd is not None:
+            self.mode = MODE_UNKNOWN
+
+    def sleep(self):
+        if self.epd is None or self.mode is None:
+            return
+        logger.info("Putting display to sleep...")
+        try:
+            getattr(self.epd, self.sleep_method)()
+            logger.info("Display sleep completed")
+        finally:
+            self.mode = None
+
+    def idle_remaining(self):
+        """Seconds until the idle timeout fires, or None if the panel is asleep"""
+        if self.mode is None:
+            return None
+        return max(0, self.last_used + self.idle_timeout - time.time())
+
+    def sleep_if_idle(self):
+        remaining = self.idle_remaining()
+        if remaining is not None and remaining <= 0:
+            logger.info(f"Display idle for {self.idle_timeout}s")
+            self.sleep()
+
+    @staticmethod
+    def frame_digest(kind, buf):
+        """Hash of a packed buffer together with the kind of refresh that shows it"""
+        return hashlib.sha1(kind.encode() + b'\0' + bytes(buf)).hexdigest()
+
+    def already_showing(self, kind, buf):
+        return self.frame_hash is not None and self.frame_hash == self.frame_digest(kind, buf)
+
+    def mark_showing(self, kind, buf):
+        """Record a frame that was successfully pushed to the panel"""
+        self.frame_hash = self.frame_digest(kind, buf)
+        self._save_frame_hash()
+
+    def forget_frame(self):
+        """The screen was changed outside this session, e.g. by the quiz"""
+        self.frame_hash = None
+        self._save_frame_hash()
+
+    def _load_frame_hash(self):
+        if not self.state_file:
+            return None
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f).get('frame_hash')
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error loading display state: {e}")
+            return None
+
+    def _save_frame_hash(self):
+        if not self.state_file:
+            return
+        try:
+            atomic_file.write(self.state_file, json.dumps({'frame_hash': self.frame_hash, 'updated': time.time()}))
+        except Exception as e:
+            logger.error(f"Error saving display state: {e}")
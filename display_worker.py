@@ -0,0 +1,102 @@
+import logging
+import queue
+import threading
+
+from jobs import Job, JobRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class DisplayBusy(Exception):
+    """Raised when the display queue is full and a job cannot be accepted"""
+
+
+class DisplayWorker:
+    """Single thread that owns the e-Paper driver.
+
+    Routes never touch the EPD object directly. They submit a render function
+    which is called as fn(session, *args) on this thread, one job at a time,
+    so SPI commands from two requests can never interleave. While the queue
+    is empty the worker also puts the panel to sleep once the session's idle
+    timeout has passed. If a job raises, on_error(session) is called after the
+    session is invalidated, to drop any other state about what is on screen.
+    """
+
+    def __init__(self, session, maxsize=8, registry=None, on_error=None):
+        self.session = session
+        self.registry = registry or JobRegistry()
+        self.on_error = on_error
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='display-worker', daemon=True)
+        self._thread.start()
+        logger.info("Display worker started")
+
+    def stop(self, timeout=30):
+        """Finish the job in progress, then stop the worker thread"""
+        self._stop.set()
+        try:
+            self._queue.put_nowait(None)  # Wake the worker if it is idle
+        except queue.Full:
+            pass
+        if self._thread:
+            self._thread.join(timeout)
+        logger.info("Display worker stopped")
+
+    def submit(self, kind, fn, *args, description='', timeout=None):
+        """Queue fn(session, *args) and return its Job.
+
+        Returns immediately unless timeout is given, in which case it waits up
+        to that many seconds for room in the queue.
+        """
+        job = self.registry.add(Job(kind, description))
+        try:
+            if timeout is None:
+                self._queue.put_nowait((job, fn, args))
+            else:
+                self._queue.put((job, fn, args), timeout=timeout)
+        except queue.Full:
+            job.mark_error('Display queue is full')
+            raise DisplayBusy('Display is busy, please try again shortly')
+        logger.info(f"Queued display job {job.id} ({kind}), {self._queue.qsize()} pending")
+        return job
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                item = self._queue.get(timeout=self.session.idle_remaining())
+            except queue.Empty:
+                self._sleep_if_idle()
+                continue
+            if item is None:
+                continue
+            job, fn, args = item
+            job.mark_running()
+            logger.info(f"Running display job {job.id} ({job.kind})")
+            try:
+                job.mark_success(fn(self.session, *args))
+                logger.info(f"Display job {job.id} completed")
+            except Exception as e:
+                logger.error(f"Display job {job.id} failed: {e}")
+                job.mark_error(e)
+                # The controller may be half-way through a command sequence
+                self.session.invalidate()
+                if self.on_error:
+                    try:
+                        self.on_error(self.session)
+                    except Exception as e:
+                        logger.error(f"Display error handler failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _sleep_if_idle(self):
+        try:
+            self.session.sleep_if_idle()
+        except Exception as e:
+            logger.error(f"Error putting idle display to sleep: {e}")
@@ -0,0 +1,61 @@
+"""Atomic file writes for the gallery, caches and state files.
+
+Every writer goes through a temporary file in the target's directory that
+is flushed to disk and then renamed over the target, so readers (the web
+app, the quiz, an interrupted run started again) only ever see the old or
+the complete new contents:
+
+    with atomic_file.open_atomic(path) as f:
+        img.save(f, 'PNG')
+
+    atomic_file.write(path, data)
+
+mkstemp gives each writer its own temporary name, so two processes writing
+the same path never interleave, but creates it 0600; the file is opened up
+to 0644 like any other gallery file before it is renamed into place.
+"""
+import contextlib
+import os
+import tempfile
+
+FILE_MODE = 0o644
+
+
+def fsync_dir(directory):
+    """Make renames in directory durable"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def open_atomic(path, mode='wb', sync_dir=False):
+    """File object that replaces path once the with block completes. If the
+    block raises, path is left untouched and the temporary file removed.
+    sync_dir also makes the rename itself durable before returning."""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            os.fchmod(f.fileno(), FILE_MODE)
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    if sync_dir:
+        fsync_dir(directory)
+
+
+def write(path, data, sync_dir=False):
+    """Replace path with data (bytes or str)"""
+    with open_atomic(path, 'wb' if isinstance(data, (bytes, bytearray, memoryview)) else 'w',
+                     sync_dir=sync_dir) as f:
+        f.write(data)
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Benchmark the reduced-resolution decode + resize against a full LANCZOS resize.
+
+Each source is scaled to the 1024x1024 DALL-E size and encoded as PNG and
+JPEG. Both paths decode the bytes, crop to 3:2 and resize to 264x176. The
+old path does it at full resolution; the new one uses image_pipeline's draft
+and reduce steps. Prints the timings, how far the outputs differ and how
+many pixels land on a different 4-gray level. Does not need the panel attached.
+
+    python bench_pipeline.py [image ...]
+"""
+import io
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+import epd_render
+import image_pipeline
+
+picdir = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'pic')
+
+SOURCE_SIZE = (1024, 1024)
+
+
+def old_path(data):
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img.resize(image_pipeline.DISPLAY_SIZE, Image.LANCZOS, box=image_pipeline.crop_box(img.size))
+
+
+def new_path(data):
+    img = image_pipeline.decode(data, image_pipeline.DISPLAY_SIZE)
+    return image_pipeline.fit_display(img)
+
+
+def best_of(fn, data, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def encode(img, fmt):
+    out = io.BytesIO()
+    img.save(out, format=fmt, **({'quality': 95} if fmt == 'JPEG' else {}))
+    return out.getvalue()
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or [os.path.join(picdir, '7in3f1.bmp'), os.path.join(picdir, '7.3inch-1.bmp')]
+    for path in paths:
+        source = Image.open(path).convert('RGB').resize(SOURCE_SIZE, Image.LANCZOS)
+        for fmt in ('PNG', 'JPEG'):
+            data = encode(source, fmt)
+            old_time, old_img = best_of(old_path, data, 10)
+            new_time, new_img = best_of(new_path, data, 10)
+
+            old_gray = np.asarray(old_img.convert('L'), dtype=np.int16)
+            new_gray = np.asarray(new_img.convert('L'), dtype=np.int16)
+            diff = np.abs(old_gray - new_gray)
+            levels = np.asarray(epd_render.quantize_4gray(old_img)) != np.asarray(epd_render.quantize_4gray(new_img))
+            print(f"{os.path.basename(path)} as {fmt}: old {old_time * 1000:.1f} ms, new {new_time * 1000:.1f} ms, "
+                  f"{old_time / new_time:.1f}x faster; gray diff mean {diff.mean():.2f} max {diff.max()}, "
+                  f"{levels.mean() * 100:.2f}% of pixels on another 4-gray level")
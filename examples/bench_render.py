@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Benchmark the 4-gray quantize + pack step against the original per-pixel path.
+
+Runs both paths on the same images, checks the packed buffers are
+byte-identical and prints the timings. Does not need the panel attached.
+
+    python bench_render.py [image ...]
+"""
+import os
+import sys
+import time
+from PIL import Image
+import epd_render
+
+picdir = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'pic')
+
+EPD_WIDTH = 176
+EPD_HEIGHT = 264
+
+
+def reference_getbuffer_4Gray(image, width=EPD_WIDTH, height=EPD_HEIGHT):
+    """Copy of waveshare epd2in7_V2.EPD.getbuffer_4Gray so this runs off the Pi"""
+    buf = [0xFF] * (int(width / 4) * height)
+    image_monocolor = image.convert('L')
+    imwidth, imheight = image_monocolor.size
+    pixels = image_monocolor.load()
+    i = 0
+    if(imwidth == width and imheight == height):
+        for y in range(imheight):
+            for x in range(imwidth):
+                if(pixels[x, y] == 0xC0):
+                    pixels[x, y] = 0x80
+                elif (pixels[x, y] == 0x80):
+                    pixels[x, y] = 0x40
+                i = i + 1
+                if(i % 4 == 0):
+                    buf[int((x + (y * width)) / 4)] = ((pixels[x-3, y] & 0xc0) | (pixels[x-2, y] & 0xc0) >> 2 | (pixels[x-1, y] & 0xc0) >> 4 | (pixels[x, y] & 0xc0) >> 6)
+    elif(imwidth == height and imheight == width):
+        for x in range(imwidth):
+            for y in range(imheight):
+                newx = y
+                newy = height - x - 1
+                if(pixels[x, y] == 0xC0):
+                    pixels[x, y] = 0x80
+                elif (pixels[x, y] == 0x80):
+                    pixels[x, y] = 0x40
+                i = i + 1
+                if(i % 4 == 0):
+                    buf[int((newx + (newy * width)) / 4)] = ((pixels[x, y-3] & 0xc0) | (pixels[x, y-2] & 0xc0) >> 2 | (pixels[x, y-1] & 0xc0) >> 4 | (pixels[x, y] & 0xc0) >> 6)
+    return buf
+
+
+def old_path(img):
+    img = img.convert('L').resize((EPD_HEIGHT, EPD_WIDTH))
+    img = img.point(lambda x: 0 if x < 64 else 85 if x < 128 else 170 if x < 192 else 255, 'L')
+    return bytes(reference_getbuffer_4Gray(img))
+
+
+def new_path(img):
+    return bytes(epd_render.render_4gray(img, EPD_WIDTH, EPD_HEIGHT))
+
+
+def best_of(fn, img, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn(img)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or [os.path.join(picdir, '2in7_Scale_resized.bmp'), os.path.join(picdir, '2in7_Scale.bmp')]
+    for path in paths:
+        img = Image.open(path)
+        img.load()
+        old_time, old_buf = best_of(old_path, img, 3)
+        new_time, new_buf = best_of(new_path, img, 20)
+        if old_buf != new_buf:
+            sys.exit(f"{path}: packed buffers differ!")
+        print(f"{os.path.basename(path)}: old {old_time * 1000:.1f} ms, new {new_time * 1000:.2f} ms, "
+              f"{old_time / new_time:.0f}x faster, {len(new_buf)} bytes identical")
@@ -0,0 +1,111 @@
+"""Dithering to the few gray levels an e-Paper panel can show.
+
+    dither(img, levels, method) -> 'L' image using only `levels` evenly spaced
+    gray values (2 for black/white, 4 for 0/85/170/255)
+
+Methods:
+    none             plain threshold (no dithering)
+    bayer            8x8 ordered dither, a single vectorized pass
+    floyd-steinberg  error diffusion to 4 neighbours
+    atkinson         error diffusion of 6/8 of the error (lighter, more contrast)
+
+Error diffusion is inherently sequential along a row, but a pixel only
+depends on pixels to its left and on the rows above. Pixels on the same
+skewed line x + k*y (k = 2 for both kernels) never depend on each other, so
+each of those lines is processed as one NumPy step: about width + 2*height
+steps per image instead of width*height Python iterations, with the exact
+same result as the per-pixel algorithm. diffuse() is the general form, also
+used to dither RGB onto the color panels' palettes (see palette.py).
+"""
+import numpy as np
+from PIL import Image
+
+METHODS = ('none', 'bayer', 'floyd-steinberg', 'atkinson')
+
+# Error diffusion kernels: (dx, dy, weight) relative to the current pixel
+KERNELS = {
+    'floyd-steinberg': ((1, 0, 7 / 16), (-1, 1, 3 / 16), (0, 1, 5 / 16), (1, 1, 1 / 16)),
+    'atkinson': ((1, 0, 1 / 8), (2, 0, 1 / 8), (-1, 1, 1 / 8), (0, 1, 1 / 8), (1, 1, 1 / 8), (0, 2, 1 / 8)),
+}
+
+
+def _bayer_matrix(n):
+    m = np.zeros((1, 1), dtype=np.int32)
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return m
+
+
+# Thresholds in (0, 1), centred in each of the 64 steps
+BAYER8 = (_bayer_matrix(8) + 0.5) / 64
+
+
+def threshold(gray, levels):
+    """Round each pixel to the nearest of the evenly spaced levels"""
+    step = 255 / (levels - 1)
+    return np.rint(np.rint(gray / step) * step).astype(np.uint8)
+
+
+def bayer(gray, levels):
+    h, w = gray.shape
+    step = 255 / (levels - 1)
+    t = np.tile(BAYER8, (h // 8 + 1, w // 8 + 1))[:h, :w]
+    q = np.clip(np.floor(gray / step + t), 0, levels - 1)
+    return np.rint(q * step).astype(np.uint8)
+
+
+def diffuse(values, kernel, nearest, colors):
+    """Error diffusion of an (h, w) or (h, w, channels) float32 array onto a set of colors.
+
+    colors is a (count,) or (count, channels) float32 array to match, and
+    nearest(v) maps an (n,) or (n, channels) array of values to the index of
+    the color each should become. Returns the (h, w) array of color indices.
+    """
+    h, w = values.shape[:2]
+    # Pad so diffused error can fall off the edges without bounds checks
+    pad_x = max(abs(dx) for dx, _, _ in kernel)
+    pad_y = max(dy for _, dy, _ in kernel)
+    stride = w + 2 * pad_x
+    work = np.zeros(((h + pad_y) * stride,) + values.shape[2:], dtype=np.float32)
+    work.reshape((h + pad_y, stride) + values.shape[2:])[:h, pad_x:pad_x + w] = values
+    out = np.empty(h * w, dtype=np.intp)
+
+    # Smallest k so every kernel target lies on a later line x + k*y
+    k = max(1, max(-(-(1 - dx) // dy) for dx, dy, _ in kernel if dy > 0))
+    offsets = [(dy * stride + dx, np.float32(weight)) for dx, dy, weight in kernel]
+    ys_all = np.arange(h)
+    for t in range(w + k * (h - 1)):
+        ys = ys_all[max(0, -(-(t - w + 1) // k)):min(h - 1, t // k) + 1]
+        xs = t - k * ys
+        idx = ys * stride + xs + pad_x
+        v = work[idx]
+        q = nearest(v)
+        out[ys * w + xs] = q
+        err = v - colors[q]
+        for offset, weight in offsets:
+            work[idx + offset] += err * weight
+    return out.reshape(h, w)
+
+
+def error_diffusion(gray, levels, kernel):
+    step = 255 / (levels - 1)
+    colors = np.arange(levels, dtype=np.float32) * np.float32(step)
+
+    def nearest(v):
+        return np.clip(np.rint(v / step), 0, levels - 1).astype(np.intp)
+
+    return np.rint(colors[diffuse(gray, kernel, nearest, colors)]).astype(np.uint8)
+
+
+def dither(img, levels=4, method='floyd-steinberg'):
+    """Reduce img to `levels` gray values with the given method, as an 'L' image"""
+    gray = np.asarray(img.convert('L'), dtype=np.float32)
+    if method == 'none':
+        out = threshold(gray, levels)
+    elif method == 'bayer':
+        out = bayer(gray, levels)
+    elif method in KERNELS:
+        out = error_diffusion(gray, levels, KERNELS[method])
+    else:
+        raise ValueError(f"Unknown dither method: {method}")
+    return Image.fromarray(out, 'L')
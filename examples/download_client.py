@@ -0,0 +1,186 @@
+"""Shared HTTP client for downloading generated images.
+
+One requests.Session per process keeps connections to the image host alive
+between downloads (DALL-E serves every image from the same blob host), so
+only the first download pays for the TCP and TLS handshakes. Every request
+has a connect and a read timeout plus an overall deadline, and the body is
+streamed in chunks with iter_content, either into memory for decoding or
+into a temporary file that is renamed into place once complete. Bytes,
+time and throughput of each download go to metrics.REGISTRY.
+
+Run it directly to check it against a local http.server:
+
+    python download_client.py
+"""
+import io
+import logging
+import os
+import tempfile
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atomic_file
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 10  # seconds to establish the connection
+READ_TIMEOUT = 30     # seconds to wait for each chunk
+DEADLINE = 120        # seconds for the whole download
+CHUNK_SIZE = 64 * 1024
+MAX_BYTES = 32 * 2**20  # a 1024x1024 DALL-E PNG is 1-3 MB
+POOL_SIZE = 4
+
+
+class DownloadClient:
+    """Pooled, timed, streaming HTTP downloads"""
+
+    def __init__(self, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 deadline=DEADLINE, chunk_size=CHUNK_SIZE, max_bytes=MAX_BYTES, registry=metrics.REGISTRY):
+        self.timeout = (connect_timeout, read_timeout)
+        self.deadline = deadline
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.registry = registry
+        self.session = requests.Session()
+        # Retry failed connects and gateway errors; a read that stalls is not retried
+        retry = Retry(total=2, read=0, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _stream(self, url, write):
+        """Stream the body of url into write(chunk); returns the number of bytes"""
+        start = time.perf_counter()
+        received = 0
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(self.chunk_size):
+                    received += len(chunk)
+                    if received > self.max_bytes:
+                        raise ValueError(f"Download is larger than {self.max_bytes} bytes")
+                    if time.perf_counter() - start > self.deadline:
+                        raise requests.Timeout(f"Download took longer than {self.deadline}s")
+                    write(chunk)
+        except Exception:
+            self.registry.incr('download.errors')
+            raise
+        elapsed = time.perf_counter() - start
+        kbps = received / 1024 / elapsed if elapsed > 0 else 0.0
+        self.registry.incr('download.count')
+        self.registry.incr('download.bytes', received)
+        self.registry.observe('download.seconds', elapsed)
+        self.registry.observe('download.throughput_kbps', kbps)
+        logger.info(f"Downloaded {received / 1024:.0f} KB in {elapsed:.2f}s ({kbps:.0f} KB/s)")
+        return received
+
+    def fetch(self, url):
+        """Body of url as bytes"""
+        buf = io.BytesIO()
+        self._stream(url, buf.write)
+        return buf.getvalue()
+
+    def download(self, url, path):
+        """Stream the body of url to path; returns its size. path only ever
+        holds a complete download."""
+        with atomic_file.open_atomic(path) as f:
+            return self._stream(url, f.write)
+
+    def close(self):
+        self.session.close()
+
+
+def self_check():
+    """Download from a local http.server: contents, connection reuse, timeouts, errors"""
+    import http.server
+    import threading
+
+    payload = os.urandom(3 * 2**20 + 123)
+    clients = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+
+        def do_GET(self):
+            clients.append(self.client_address)
+            if self.path == '/slow':
+                time.sleep(1.5)
+            if self.path == '/missing':
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            if self.path == '/chunked':
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i in range(0, len(payload), 100000):
+                    part = payload[i:i + 100000]
+                    self.wfile.write(f'{len(part):x}\r\n'.encode() + part + b'\r\n')
+                self.wfile.write(b'0\r\n\r\n')
+                return
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(http.server.ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            pass  # The timeout and size checks hang up on purpose
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    registry = metrics.Metrics()
+    client = DownloadClient(read_timeout=1, registry=registry)
+    try:
+        assert client.fetch(base + '/image') == payload
+        assert client.fetch(base + '/chunked') == payload
+        assert clients[0] == clients[1], 'connection was not reused'
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'image.png')
+            assert client.download(base + '/image', path) == len(payload)
+            with open(path, 'rb') as f:
+                assert f.read() == payload
+            try:
+                client.download(base + '/missing', path)
+                raise AssertionError('404 did not raise')
+            except requests.HTTPError:
+                pass
+            assert os.listdir(tmp) == ['image.png'], 'temporary file left behind'
+
+        try:
+            client.fetch(base + '/slow')
+            raise AssertionError('read timeout did not fire')
+        except (requests.Timeout, requests.ConnectionError):
+            # Depending on the urllib3 version a read timeout surfaces as either
+            pass
+
+        small = DownloadClient(max_bytes=2**20, registry=registry)
+        try:
+            small.fetch(base + '/image')
+            raise AssertionError('size limit did not apply')
+        except ValueError:
+            pass
+        small.close()
+    finally:
+        client.close()
+        server.shutdown()
+
+    stats = registry.snapshot()
+    assert stats['counters']['download.count'] == 3
+    assert stats['counters']['download.errors'] == 3
+    throughput = stats['summaries']['download.throughput_kbps']
+    print(f"OK: 3 downloads of {len(payload)} bytes, {throughput['mean']:.0f} KB/s on average, "
+          f"3 failures caught")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    self_check()
@@ -0,0 +1,24 @@
+"""Select the e-Paper driver module: the Waveshare hardware driver or the simulator.
+
+    EPD_BACKEND=sim python app_1bit_working.py
+
+runs everything against epd_sim instead of the panel on the SPI bus.
+"""
+import importlib
+import os
+
+SIMULATED_MODELS = ('epd2in7_V2',)
+
+
+def use_simulator():
+    return os.getenv('EPD_BACKEND', 'hardware').lower() == 'sim'
+
+
+def load_driver(model='epd2in7_V2'):
+    """Return the driver module for model, e.g. waveshare_epd.epd2in7_V2"""
+    if use_simulator():
+        if model not in SIMULATED_MODELS:
+            raise ValueError(f"No simulated driver for {model}")
+        import epd_sim
+        return epd_sim
+    return importlib.import_module(f'waveshare_epd.{model}')
@@ -0,0 +1,90 @@
+import logging
+
+import numpy as np
+
+import dither
+
+logger = logging.getLogger(__name__)
+
+# 4-level grayscale quantization: 0, 85, 170, 255 (Harry Potter quiz technique)
+GRAY4_LUT = [0 if x < 64 else 85 if x < 128 else 170 if x < 192 else 255 for x in range(256)]
+
+# 2-bit code the waveshare getbuffer_4Gray loop produces for each 'L' value:
+# it remaps 0xC0 -> 0x80 and 0x80 -> 0x40, then keeps the top two bits
+_CODE_LUT = np.array([((0x80 if v == 0xC0 else 0x40 if v == 0x80 else v) & 0xC0) >> 6
+                      for v in range(256)], dtype=np.uint8)
+
+
+def quantize_4gray(img):
+    """Map an image to the 4 grayscale levels with a precomputed 256-entry LUT"""
+    return img.convert('L').point(GRAY4_LUT)
+
+
+def pack_4gray(img, width=176, height=264):
+    """Pack an image into the 2bpp buffer layout of epd.getbuffer_4Gray.
+
+    width/height are the panel's native (portrait) dimensions. Like the driver,
+    a landscape image (height x width) is rotated into panel orientation and an
+    image of any other size yields an all-white buffer. Output is byte-identical
+    to the driver's per-pixel loop but vectorized with NumPy.
+    """
+    gray = img.convert('L')
+    if gray.size == (width, height):
+        codes = _CODE_LUT[np.asarray(gray)]
+    elif gray.size == (height, width):
+        # Landscape pixel (x, y) lands at panel (y, height - 1 - x)
+        codes = np.rot90(_CODE_LUT[np.asarray(gray)])
+    else:
+        logger.warning(f"Wrong image dimensions: must be {width}x{height}")
+        return bytearray([0xFF] * (width // 4 * height))
+
+    codes = codes.reshape(height, width // 4, 4)
+    packed = (codes[:, :, 0] << 6) | (codes[:, :, 1] << 4) | (codes[:, :, 2] << 2) | codes[:, :, 3]
+    return bytearray(packed.tobytes())
+
+
+def pack_1bit(img, width=176, height=264):
+    """Pack an image into the 1bpp buffer layout of epd.getbuffer.
+
+    Pixels of 128 and above are white and rows are padded to whole bytes. A
+    landscape image is rotated into panel orientation; any other size yields
+    an all-black buffer, as in the driver.
+    """
+    gray = img.convert('L')
+    if gray.size == (width, height):
+        bits = np.asarray(gray) >= 128
+    elif gray.size == (height, width):
+        bits = np.rot90(np.asarray(gray) >= 128)
+    else:
+        logger.warning(f"Wrong image dimensions: must be {width}x{height}")
+        return bytearray((width + 7) // 8 * height)
+    return bytearray(np.packbits(bits, axis=1).tobytes())
+
+
+def _fit_landscape(img, width, height):
+    img = img.convert('L')
+    landscape = (max(width, height), min(width, height))
+    if img.size != landscape:
+        img = img.resize(landscape)
+    return img
+
+
+def render_4gray(img, width=176, height=264, dither_method='none'):
+    """Resize to the panel in landscape, reduce to 4 levels and pack for display_4Gray.
+
+    With dither_method 'none' the levels come from the fixed 64/128/192
+    thresholds; otherwise see dither.METHODS.
+    """
+    img = _fit_landscape(img, width, height)
+    if dither_method == 'none':
+        img = quantize_4gray(img)
+    else:
+        img = dither.dither(img, 4, dither_method)
+    return pack_4gray(img, width, height)
+
+
+def render_1bit(img, width=176, height=264, dither_method='none'):
+    """Resize to the panel in landscape, reduce to black and white and pack for display/display_Base"""
+    img = dither.dither(_fit_landscape(img, width, height), 2, dither_method)
+    return pack_1bit(img, width, height)
+
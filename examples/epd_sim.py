@@ -0,0 +1,232 @@
+"""Simulated Waveshare epd2in7_V2 driver for running and profiling without a Pi.
+
+Implements the parts of the waveshare_epd.epd2in7_V2 API the apps use. Every
+refresh is recorded as a frame together with a modeled SPI transfer and panel
+refresh time, and the simulated screen contents are tracked so they can be
+dumped as PNGs. Select it with EPD_BACKEND=sim (see epd_backend.py).
+
+Environment:
+    EPD_SIM_SPEED  Multiplier for the modeled delays; 1 sleeps in real time,
+                   0 (the default) only accounts for them
+    EPD_SIM_DIR    If set, the screen is saved there as a PNG after each refresh
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+EPD_WIDTH = 176
+EPD_HEIGHT = 264
+
+GRAY1 = 0xff  # white
+GRAY2 = 0xC0
+GRAY3 = 0x80  # gray
+GRAY4 = 0x00  # Blackest
+
+# Approximate timings of a 2.7" V2 panel on a Pi 3B, in seconds
+RESET_TIME = 0.045
+SLEEP_TIME = 2.0  # epd.sleep() waits 2 s before releasing the SPI bus
+INIT_TIME = {'init': 0.05, 'init_Fast': 0.06, 'Init_4Gray': 0.12}
+REFRESH_TIME = {
+    'display': 3.9,
+    'display_Base': 3.9,
+    'Clear': 3.9,
+    'display_Fast': 1.6,
+    'display_Partial': 0.42,
+    'display_4Gray': 5.4,
+}
+SPI_HZ = 4000000
+SPI_BYTE_OVERHEAD = 12e-6  # Python send_data() call per byte
+
+MAX_FRAMES = 500
+
+
+class _EpdConfig:
+    """Stand-in for waveshare_epd.epdconfig"""
+
+    def module_init(self):
+        return 0
+
+    def module_exit(self, cleanup=False):
+        logger.debug("epd_sim: module_exit")
+
+
+epdconfig = _EpdConfig()
+
+
+class EPD:
+    def __init__(self):
+        self.width = EPD_WIDTH
+        self.height = EPD_HEIGHT
+        self.GRAY1 = GRAY1
+        self.GRAY2 = GRAY2
+        self.GRAY3 = GRAY3
+        self.GRAY4 = GRAY4
+
+        self.speed = float(os.getenv('EPD_SIM_SPEED', '0'))
+        self.dump_dir = os.getenv('EPD_SIM_DIR')
+        self.init_mode = None  # None while asleep
+        self.frames = collections.deque(maxlen=MAX_FRAMES)
+        self.stats = collections.defaultdict(lambda: {'count': 0, 'modeled_time': 0.0, 'spi_bytes': 0})
+        # Panel-native screen contents, 'L' with 0..255
+        self.screen = np.full((EPD_HEIGHT, EPD_WIDTH), 255, dtype=np.uint8)
+        self._busy = threading.Lock()
+
+    # Driver API
+
+    def init(self):
+        self._init('init')
+
+    def init_Fast(self):
+        self._init('init_Fast')
+
+    def Init_4Gray(self):
+        self._init('Init_4Gray')
+
+    def Clear(self):
+        white = np.full_like(self.screen, 255)
+        self._refresh('Clear', self.width // 8 * self.height * 2, None, white)
+
+    def display(self, image):
+        self._refresh('display', len(image), image, self._decode_1bit(image))
+
+    def display_Fast(self, image):
+        self._require_mode('display_Fast', 'init_Fast')
+        self._refresh('display_Fast', len(image), image, self._decode_1bit(image))
+
+    def display_Base(self, image):
+        # Written to both the new and old image RAM
+        self._refresh('display_Base', len(image) * 2, image, self._decode_1bit(image))
+
+    def display_Partial(self, Image, Xstart, Ystart, Xend, Yend):
+        x0, x1 = Xstart // 8 * 8, -(-Xend // 8) * 8
+        screen = self.screen.copy()
+        screen[Ystart:Yend, x0:x1] = self._decode_1bit(Image)[Ystart:Yend, x0:x1]
+        sent = (x1 - x0) // 8 * (Yend - Ystart)
+        self._refresh('display_Partial', sent, Image, screen, rect=(Xstart, Ystart, Xend, Yend), reset=True)
+
+    def display_4Gray(self, image):
+        self._require_mode('display_4Gray', 'Init_4Gray')
+        # The driver splits the 2bpp buffer into two 1bpp planes before sending
+        self._refresh('display_4Gray', len(image), image, self._decode_4gray(image))
+
+    def sleep(self):
+        self._record('sleep', 0, SLEEP_TIME)
+        self.init_mode = None
+
+    def getbuffer(self, image):
+        img = image
+        imwidth, imheight = img.size
+        if(imwidth == self.width and imheight == self.height):
+            img = img.convert('1')
+        elif(imwidth == self.height and imheight == self.width):
+            # image has correct dimensions, but needs to be rotated
+            img = img.rotate(90, expand=True).convert('1')
+        else:
+            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
+            # return a blank buffer
+            return [0x00] * (int(self.width/8) * self.height)
+
+        buf = bytearray(img.tobytes('raw'))
+        return buf
+
+    def getbuffer_4Gray(self, image):
+        # Same per-pixel loop as the real driver, so CPU cost is representative
+        buf = [0xFF] * (int(self.width / 4) * self.height)
+        image_monocolor = image.convert('L')
+        imwidth, imheight = image_monocolor.size
+        pixels = image_monocolor.load()
+        i = 0
+        if(imwidth == self.width and imheight == self.height):
+            for y in range(imheight):
+                for x in range(imwidth):
+                    if(pixels[x, y] == 0xC0):
+                        pixels[x, y] = 0x80
+                    elif (pixels[x, y] == 0x80):
+                        pixels[x, y] = 0x40
+                    i = i + 1
+                    if(i % 4 == 0):
+                        buf[int((x + (y * self.width))/4)] = ((pixels[x-3, y] & 0xc0) | (pixels[x-2, y] & 0xc0) >> 2 | (pixels[x-1, y] & 0xc0) >> 4 | (pixels[x, y] & 0xc0) >> 6)
+        elif(imwidth == self.height and imheight == self.width):
+            for x in range(imwidth):
+                for y in range(imheight):
+                    newx = y
+                    newy = self.height - x - 1
+                    if(pixels[x, y] == 0xC0):
+                        pixels[x, y] = 0x80
+                    elif (pixels[x, y] == 0x80):
+                        pixels[x, y] = 0x40
+                    i = i + 1
+                    if(i % 4 == 0):
+                        buf[int((newx + (newy * self.width))/4)] = ((pixels[x, y-3] & 0xc0) | (pixels[x, y-2] & 0xc0) >> 2 | (pixels[x, y-1] & 0xc0) >> 4 | (pixels[x, y] & 0xc0) >> 6)
+        return buf
+
+    # Simulation helpers
+
+    def screen_image(self):
+        """Current screen contents as a landscape 'L' image"""
+        return Image.fromarray(np.rot90(self.screen, -1).copy(), 'L')
+
+    def summary(self):
+        """Per-operation counts, SPI bytes and modeled time"""
+        return {op: dict(s) for op, s in self.stats.items()}
+
+    def _init(self, mode):
+        self._record(mode, 0, RESET_TIME + INIT_TIME[mode])
+        self.init_mode = mode
+
+    def _require_mode(self, op, mode):
+        if self.init_mode != mode:
+            logger.warning(f"epd_sim: {op} called after {self.init_mode or 'sleep'} instead of {mode}")
+
+    def _refresh(self, op, spi_bytes, buffer, screen, rect=None, reset=False):
+        if self.init_mode is None:
+            raise RuntimeError(f"epd_sim: {op} called while the panel is asleep")
+        modeled = spi_bytes * (8 / SPI_HZ + SPI_BYTE_OVERHEAD) + REFRESH_TIME[op]
+        if reset:
+            modeled += RESET_TIME
+        self._record(op, spi_bytes, modeled, buffer, screen, rect)
+
+    def _record(self, op, spi_bytes, modeled, buffer=None, screen=None, rect=None):
+        # Two threads driving the panel at once would corrupt a real display
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError(f"epd_sim: concurrent access to the panel during {op}")
+        try:
+            if self.speed:
+                time.sleep(modeled * self.speed)
+            if screen is not None:
+                self.screen = screen
+            self.frames.append({
+                'op': op,
+                'time': time.time(),
+                'thread': threading.current_thread().name,
+                'buffer': bytes(buffer) if buffer is not None else None,
+                'rect': rect,
+                'spi_bytes': spi_bytes,
+                'modeled_time': modeled,
+            })
+            stats = self.stats[op]
+            stats['count'] += 1
+            stats['spi_bytes'] += spi_bytes
+            stats['modeled_time'] += modeled
+        finally:
+            self._busy.release()
+        logger.debug(f"epd_sim: {op} ({spi_bytes} bytes, {modeled:.3f}s modeled)")
+        if screen is not None and self.dump_dir:
+            os.makedirs(self.dump_dir, exist_ok=True)
+            self.screen_image().save(os.path.join(self.dump_dir, f"frame_{len(self.frames):04d}_{op}.png"))
+
+    def _decode_1bit(self, buf):
+        bits = np.unpackbits(np.frombuffer(bytes(buf), dtype=np.uint8))
+        return (bits.reshape(self.height, self.width) * 255).astype(np.uint8)
+
+    def _decode_4gray(self, buf):
+        packed = np.frombuffer(bytes(buf), dtype=np.uint8).reshape(self.height, self.width // 4)
+        codes = np.stack([(packed >> shift) & 3 for shift in (6, 4, 2, 0)], axis=-1)
+        return (codes.reshape(self.height, self.width) * 85).astype(np.uint8)
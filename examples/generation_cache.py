@@ -0,0 +1,115 @@
+"""Reuse gallery images made from the same prompt instead of generating again.
+
+A generation is keyed on its normalized prompt (case, spacing and
+surrounding punctuation ignored), the model and the image size. Each image
+the app or the quiz generates is recorded under its key in
+generation_cache.json, a journaled store shared by both processes (see
+metadata_store). Gallery images made before the cache existed are found
+through their description, which is the prompt they were made from.
+
+lookup() returns an existing variant according to the policy:
+
+    always  reuse the newest variant
+    ttl     reuse the newest variant if it is younger than ttl seconds
+    random  pick any of the variants, spreading repeats over the set
+    off     always generate
+
+and None when the prompt has to go to the network.
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from metadata_store import MetadataStore
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = '/home/pi/rpi-screen/generation_cache.json'
+IMAGES_DIR = '/home/pi/rpi-screen/images'
+DEFAULT_MODEL = 'dall-e-3'
+DEFAULT_SIZE = '1024x1024'
+POLICIES = ('always', 'ttl', 'random', 'off')
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def normalize_prompt(prompt):
+    """Prompt reduced to what matters for the image: 'Owl, flying! ' -> 'owl, flying'"""
+    text = unicodedata.normalize('NFKC', prompt).lower()
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(' \'".!?,;:')
+
+
+def cache_key(prompt, model=DEFAULT_MODEL, size=DEFAULT_SIZE):
+    return f"{model}|{size}|{normalize_prompt(prompt)}"
+
+
+class GenerationCache:
+    """Prompt -> gallery images made from it, with the reuse policy"""
+
+    def __init__(self, metadata, images_dir=IMAGES_DIR, path=CACHE_FILE, policy='always', ttl=DEFAULT_TTL):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown generation cache policy: {policy} (expected one of {', '.join(POLICIES)})")
+        self.metadata = metadata
+        self.images_dir = images_dir
+        self.records = MetadataStore(path)
+        self.policy = policy
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> [(filename, time recorded or None), ...], rebuilt when either store changes
+        self.variants = {}
+        self.versions = None
+
+    def _index(self):
+        with self.lock:
+            versions = (self.metadata.version(), self.records.version())
+            if versions != self.versions:
+                variants = {}
+                records = self.records.snapshot()
+                for filename, record in records.items():
+                    if isinstance(record, dict):
+                        variants.setdefault(record['key'], []).append((filename, record.get('created')))
+                for filename, description in self.metadata.snapshot().items():
+                    if filename not in records and isinstance(description, str):
+                        variants.setdefault(cache_key(description), []).append((filename, None))
+                self.variants = variants
+                self.versions = versions
+            return self.variants
+
+    def lookup(self, prompt, model=DEFAULT_MODEL, size=DEFAULT_SIZE):
+        """Path of a gallery image to reuse for prompt, or None to generate a new one"""
+        if self.policy == 'off':
+            return None
+        candidates = []
+        for filename, created in self._index().get(cache_key(prompt, model, size), ()):
+            path = os.path.join(self.images_dir, filename)
+            try:
+                mtime = os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            candidates.append((created or mtime, path))
+        if not candidates:
+            return None
+        if self.policy == 'random':
+            path = random.choice(candidates)[1]
+        else:
+            created, path = max(candidates)
+            if self.policy == 'ttl' and time.time() - created > self.ttl:
+                logger.info(f"Cached image for '{prompt[:40]}' is older than {self.ttl}s, generating a new one")
+                return None
+        logger.info(f"Reusing {os.path.basename(path)} for '{prompt[:40]}' ({len(candidates)} cached)")
+        return path
+
+    def record(self, prompt, filename, model=DEFAULT_MODEL, size=DEFAULT_SIZE):
+        """Remember that filename was generated from prompt"""
+        self.records.set(filename, {'key': cache_key(prompt, model, size), 'created': time.time()})
+
+    def forget(self, filename):
+        """Drop the record of filename, e.g. when its generation is rolled back"""
+        if filename in self.records:
+            self.records.delete(filename)
+
+    def flush(self):
+        self.records.flush()
@@ -1,15 +1,22 @@
 import os
 import sys
 import time
+import uuid
 from PIL import Image, ImageDraw, ImageFont
 from gpiozero import Button
 sys.path.append('../lib')  # Path to Waveshare library
 sys.path.append('/home/pi/e-Paper/RaspberryPi_JetsonNano/python/lib')  # Adjust path as needed
-from waveshare_epd import epd2in7_V2
+import epd_backend
+epd2in7_V2 = epd_backend.load_driver('epd2in7_V2')
 from dotenv import load_dotenv
 from openai import OpenAI
 import ast
 import image_generator as imgn
+import epd_render
+import packed_image
+from metadata_store import MetadataStore
+from generation_cache import GenerationCache, DEFAULT_TTL
+from prize_pool import PrizePool
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,6 +24,16 @@ load_dotenv()
 # Set OpenAI API key
 client = OpenAI(api_key=os.getenv("OPENAI_KEY"))
 
+# Gallery descriptions, shared with the web app
+metadata_store = MetadataStore()
+
+# Images already generated for a topic are reused instead of calling DALL-E again
+generation_cache = GenerationCache(metadata_store, policy=os.getenv('GENERATION_CACHE_POLICY', 'random'),
+                                   ttl=float(os.getenv('GENERATION_CACHE_TTL', DEFAULT_TTL)))
+
+# Prize images generated and packed ahead of time, shared by every game in this process
+prize_pool = None
+
 
 class quizGame:
     def __init__(self):
@@ -31,6 +48,7 @@ class quizGame:
         self.score = 0
         self.init_buttons()
         self.init_screen()
+        self.init_prize_pool()
 
     def init_buttons(self):
         # Buttons
@@ -46,6 +64,13 @@ class quizGame:
         self.WIDTH, self.HEIGHT = self.epd.width, self.epd.height
         self.FONT = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 12)
 
+    def init_prize_pool(self):
+        global prize_pool
+        if prize_pool is None:
+            prize_pool = PrizePool(lambda topic: self.generate_4bit_image(topic, reuse=False), self.pack_4bit,
+                                   size=int(os.getenv('PRIZE_POOL_SIZE', '2')))
+        self.prize_pool = prize_pool
+
     def load_questions(self, questions):
         """Load questions into the game."""
         self.questions = questions
@@ -54,6 +79,7 @@ class quizGame:
 
     def show_text(self, lines):
         """Display multiple lines of text on the e-Paper screen in landscape orientation."""
+        self.prize_pool.touch()
         self.epd.init()
         self.epd.Clear()
         
@@ -75,9 +101,11 @@ class quizGame:
 
         # Sleep
         self.epd.sleep()
+        self.prize_pool.touch()
 
     def quick_refresh(self, lines=["Hello world"]):
         # Quick refresh
+        self.prize_pool.touch()
         self.epd.init_Fast()
         # Drawing on the Vertical image
         Himage = Image.new('1', (self.epd.height, self.epd.width), 255)  # 255: clear the frame
@@ -96,6 +124,7 @@ class quizGame:
         time.sleep(1)
         # Sleep
         self.epd.sleep()
+        self.prize_pool.touch()
 
     def wrap_text(self, text, font, max_width):
         """Wrap text to fit within the specified width."""
@@ -170,23 +199,30 @@ class quizGame:
         
         return questions
 
-    def generate_4bit_image(self,topic=None):
+    def generate_4bit_image(self,topic=None,reuse=True):
         # Set topic if not provided
         if topic is None:
             topic = r"Harry Potter world artwork, not just related to Harry Potter character, but also to the whole Harry Potter world, with Hogwarts castle, magical creatures, OR other elements of the wizarding world. More so than just artwork of the characters, but also the world they live in, the magical creatures, the Hogwarts castle, and other elements of the wizarding world. The image should be colorful, vibrant, and capture the essence of the Harry Potter universe."
 
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        filepath = f"/home/pi/rpi-screen/images/ai_hp_{timestamp}.bmp"
-        filepath_new = f"/home/pi/rpi-screen/images/ai_hp_crop_{timestamp}.bmp"
+        # Reuse an image already made from this topic if the cache policy allows it
+        cached = generation_cache.lookup(topic) if reuse else None
+        if cached:
+            return cached
+
+        # Timestamp plus a random part: a prize pool refill and a direct
+        # generation can run in the same second
+        timestamp = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        original_base = f"/home/pi/rpi-screen/images/ai_hp_{timestamp}"
         filepath_resized = f"/home/pi/rpi-screen/images/ai_hp_image_resized_{timestamp}.bmp"
-        filepath_4bit = f"/home/pi/rpi-screen/images/ai_hp_4bit_{timestamp}.bmp"
 
-        # Generate the image
-        imgn.generate_image(topic, filepath)
-        # Crop the image to 3:2 aspect ratio
-        imgn.crop_image_3_2(filepath, filepath_new)
-        # Resize image down to fit the e-Paper display: 264x176 pixels
-        imgn.resize_image(filepath_new, filepath_resized)
+        # Generate the image, then crop to 3:2 and resize to 264x176 in memory;
+        # only the resized image and the compressed original are written
+        imgn.generate_display_image(topic, filepath_resized, original_base)
+        # Describe it in the gallery; the store merges this with the web app's updates
+        metadata_store.set(os.path.basename(filepath_resized), topic)
+        metadata_store.flush()
+        generation_cache.record(topic, os.path.basename(filepath_resized))
+        generation_cache.flush()
         # # Function to display the image on the e-Paper display
         # self.display_image_4bit(filepath_resized)
         return filepath_resized
@@ -204,21 +240,22 @@ class quizGame:
         # Function to display the image on the e-Paper display
         self.display_image_4bit(filepath_resized)
 
-    def display_image_4bit(self, filepath):
-        """Display a 4-level grayscale image on the e-Paper screen."""
-        self.epd.Init_4Gray()
-
-        # Load and process image
-        img = Image.open(filepath).convert('L')  # Convert to grayscale
-        img = img.resize((self.epd.height, self.epd.width))
+    def pack_4bit(self, filepath):
+        """Load, resize, map to 4 grayscale levels (0, 85, 170, 255) and pack for the panel."""
+        return epd_render.render_4gray(packed_image.open_image(filepath), self.epd.width, self.epd.height)
 
-        # Map to 4 grayscale levels: 0, 85, 170, 255
-        img = img.point(lambda x: 0 if x < 64 else 85 if x < 128 else 170 if x < 192 else 255, 'L')
+    def display_image_4bit(self, filepath, buf=None):
+        """Display a 4-level grayscale image on the e-Paper screen, packing it unless buf is given."""
+        self.prize_pool.touch()
+        if buf is None:
+            buf = self.pack_4bit(filepath)
+        self.epd.Init_4Gray()
 
         # Display directly
-        self.epd.display_4Gray(self.epd.getbuffer_4Gray(img))
+        self.epd.display_4Gray(buf)
         time.sleep(2)
         self.epd.sleep()
+        self.prize_pool.touch()
         print(f"Image displayed on e-Paper display from {filepath}")
     
     def show_question(self, question):
@@ -278,8 +315,13 @@ class quizGame:
             # Wait for any key to continue
             while True:
                 if self.btn1.is_pressed or self.btn2.is_pressed or self.btn3.is_pressed or self.btn4.is_pressed:
-                    # Generate image
-                    fp_4bit_img = self.generate_4bit_image(topic=self.topic)
+                    # Take a ready prize from the pool (its slot is refilled in the background),
+                    # falling back to a cached or new image if it has run dry
+                    prize = self.prize_pool.take(self.topic)
+                    if prize:
+                        fp_4bit_img, buf = prize
+                    else:
+                        fp_4bit_img, buf = self.generate_4bit_image(topic=self.topic), None
                         
                     # #### TEST: Display image 
                     # fp_4bit_img = r'/home/pi/rpi-screen/images/ai_hp_image_resized_20250529_094532.bmp'
@@ -289,7 +331,7 @@ class quizGame:
 
                     # Show image
                     print(f'Filepath of 4bit image generated: {fp_4bit_img}')
-                    self.display_image_4bit(fp_4bit_img)
+                    self.display_image_4bit(fp_4bit_img, buf)
 
                     # While True:
                     while True:
@@ -323,6 +365,9 @@ class quizGame:
                 sys.exit("Exiting the quiz.")
     
     def start_game(self):
+        # Start preparing prize images while the questions are played
+        self.prize_pool.want(self.topic)
+
         # Generate and load questions
         print("Generating questions...")
         self.questions = self.generate_questions(self.topic, self.question_count, self.difficulty, self.options)
@@ -4,7 +4,9 @@ import sys
 import os
 from dotenv import load_dotenv
 from openai import OpenAI
-import requests
+import epd_render
+import image_pipeline
+from download_client import DownloadClient
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,16 +14,20 @@ load_dotenv()
 # Set OpenAI API key
 client = OpenAI(api_key=os.getenv("OPENAI_KEY"))
 
+# Keep-alive connection to the image host, reused for every download
+download_client = DownloadClient()
+
 # Path to the Waveshare library
 sys.path.append('/home/pi/e-Paper/RaspberryPi_JetsonNano/python/lib')
-from waveshare_epd import epd2in7_V2  # Use the correct driver
+import epd_backend
+epd2in7_V2 = epd_backend.load_driver('epd2in7_V2')  # Use the correct driver
 
 
 
 
 
-# Generate an image based on a topic using OpenAI's DALL·E API
-def generate_image(topic, filepath):
+# Request an image about a topic from OpenAI's DALL·E API and return its URL
+def request_image(topic):
     print("Generating image...")
     # Request a 3:2 aspect ratio, minimal size, black and white image
     response = client.images.generate(
@@ -32,13 +38,18 @@ def generate_image(topic, filepath):
         response_format="url"
     )
 
-    # Download the image
-    image_url = response.data[0].url
-    img_data = requests.get(image_url).content
+    return response.data[0].url
+
+
+# Request an image about a topic and return the downloaded bytes
+def download_image(topic):
+    return download_client.fetch(request_image(topic))
 
-    # Save the image
-    with open(filepath, 'wb') as handler:
-        handler.write(img_data)
+
+# Generate an image based on a topic using OpenAI's DALL·E API
+def generate_image(topic, filepath):
+    # Stream the image straight to disk
+    download_client.download(request_image(topic), filepath)
 
     # # Convert to black and white using PIL
     # img = Image.open(filepath).convert('1')
@@ -47,6 +58,15 @@ def generate_image(topic, filepath):
     print(f"Image saved to {filepath}")
 
 
+# Generate an image and crop/resize it for the e-Paper display in memory,
+# writing only the 264x176 image (and the original if original_base is given)
+def generate_display_image(topic, filepath_resized, original_base=None):
+    img_data = download_image(topic)
+    display_img, _, _ = image_pipeline.process_download(img_data, filepath_resized, original_base)
+    print(f"Image resized to fit e-Paper display and saved to {filepath_resized}")
+    return display_img
+
+
 # Crop the image to a 3:2 aspect ratio
 def crop_image_3_2(filepath, filepath_new):
     img = Image.open(filepath)
@@ -76,27 +96,16 @@ def crop_image_3_2(filepath, filepath_new):
 # Resize image down to fit the e-Paper display: 264x176 pixels
 def resize_image(filepath, filepath_new):
     img = Image.open(filepath)
-    img_resized = img.resize((264, 176), Image.ANTIALIAS)
+    img_resized = img.resize(image_pipeline.DISPLAY_SIZE, Image.LANCZOS, reducing_gap=image_pipeline.REDUCING_GAP)
     img_resized.save(filepath_new)
     print(f"Image resized to fit e-Paper display and saved to {filepath_new}")
 
 # Function to convert image to 4-bit bitmap format
 def convert_to_4bit(filepath,filepath_new):
     img = Image.open(filepath)
-    img = img.convert('L')  # Convert to grayscale
 
     # Quantize to 4 grayscale levels (0, 85, 170, 255)
-    def quantize_4gray(x):
-        if x < 64:
-            return 0
-        elif x < 128:
-            return 85
-        elif x < 192:
-            return 170
-        else:
-            return 255
-
-    img = img.point(quantize_4gray, 'L')
+    img = epd_render.quantize_4gray(img)
     img.save(filepath_new, format='BMP')
     print(f"Image converted to 4-color grayscale and saved to {filepath_new}")
 
@@ -0,0 +1,165 @@
+"""Turn a downloaded image into a gallery image in one in-memory pass.
+
+The downloaded bytes are decoded once, center-cropped and resized in a single
+resample, and only the display-sized BMP is written. The original can be kept
+too, written as downloaded if it is already compressed (DALL-E returns PNG).
+
+Sources are shrunk cheaply before the final LANCZOS resample: JPEGs are
+decoded at 1/2, 1/4 or 1/8 scale (draft mode) and anything else is reduced
+by an integer factor (Image.reduce), in both cases stopping at REDUCING_GAP
+times the target size. See bench_pipeline.py for the timings and the
+difference from a full-resolution LANCZOS resize.
+"""
+import hashlib
+import io
+import logging
+import math
+import os
+import re
+from PIL import Image
+import atomic_file
+
+logger = logging.getLogger(__name__)
+
+DISPLAY_SIZE = (264, 176)  # landscape, 3:2
+# Shrink by cheap integer steps while the source stays at least this many times
+# larger than the target. Just under 2 so a 1024px DALL-E crop (3.9x the
+# target) is halved first; the result differs from a plain LANCZOS resize by
+# well under 1 gray level on average
+REDUCING_GAP = 1.9
+COMPRESSED_FORMATS = {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp'}
+
+# Kept originals and the gallery image generated from each
+# (<ts> is the time of generation, optionally followed by a random _<8 hex> part)
+ORIGINAL_PATTERNS = [
+    (re.compile(r'^ai_custom_(\d{8}_\d{6}(?:_[0-9a-f]{8})?)\.(png|jpg|webp|bmp)$'), 'ai_custom_{}_resized.bmp'),
+    (re.compile(r'^ai_hp_(\d{8}_\d{6}(?:_[0-9a-f]{8})?)\.(png|jpg|webp|bmp)$'), 'ai_hp_image_resized_{}.bmp'),
+]
+RESIZED_PATTERNS = [
+    (re.compile(r'^ai_custom_(\d{8}_\d{6}(?:_[0-9a-f]{8})?)_resized\.(bmp|epd)$'), 'ai_custom_{}'),
+    (re.compile(r'^ai_hp_image_resized_(\d{8}_\d{6}(?:_[0-9a-f]{8})?)\.(bmp|epd)$'), 'ai_hp_{}'),
+]
+
+
+def crop_box(size, ratio=3 / 2):
+    """Centered (left, top, right, bottom) box of the given width/height ratio"""
+    width, height = size
+    if width / height > ratio:
+        # Too wide: crop width
+        new_width = height * ratio
+        left = (width - new_width) / 2
+        return (left, 0, left + new_width, height)
+    # Too tall or square: crop height
+    new_height = width / ratio
+    top = (height - new_height) / 2
+    return (0, top, width, top + new_height)
+
+
+def draft_size(source_size, size=DISPLAY_SIZE):
+    """Smallest full-image size whose center crop is still REDUCING_GAP times size"""
+    left, top, right, bottom = crop_box(source_size, size[0] / size[1])
+    scale = max(size[0] / (right - left), size[1] / (bottom - top)) * REDUCING_GAP
+    return (math.ceil(source_size[0] * scale), math.ceil(source_size[1] * scale))
+
+
+def resized_name(original_name):
+    """Name of the gallery image generated from a kept original, or None"""
+    for pattern, template in ORIGINAL_PATTERNS:
+        m = pattern.match(original_name)
+        if m:
+            return template.format(m.group(1))
+    return None
+
+
+def original_for(path):
+    """Path of the original kept for a gallery image, or None"""
+    name = os.path.basename(path)
+    for pattern, template in RESIZED_PATTERNS:
+        m = pattern.match(name)
+        if m:
+            base = os.path.join(os.path.dirname(path), template.format(m.group(1)))
+            for ext in ('.png', '.jpg', '.webp', '.bmp'):
+                if os.path.exists(base + ext):
+                    return base + ext
+    return None
+
+
+def rendition_source(path, size):
+    """Best file to render a gallery image from at size: its original if size is
+    larger than the gallery's DISPLAY_SIZE and the original was kept"""
+    if size[0] > DISPLAY_SIZE[0] or size[1] > DISPLAY_SIZE[1]:
+        return original_for(path) or path
+    return path
+
+
+def decode(data, size=None):
+    """Decode image bytes fully into memory.
+
+    If size is given and the data is a JPEG, the decoder scales it down by
+    up to 8x while keeping enough resolution to fit_display to size.
+    """
+    img = Image.open(io.BytesIO(data))
+    if size and img.format == 'JPEG':
+        img.draft(None, draft_size(img.size, size))
+    img.load()
+    return img
+
+
+def fit_display(img, size=DISPLAY_SIZE):
+    """Center-crop img to the aspect ratio of size and resize it with LANCZOS.
+
+    Large sources are first reduced by an integer factor, which is much
+    cheaper than running LANCZOS over the full-resolution crop.
+    """
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    return img.resize(size, Image.LANCZOS, box=crop_box(img.size, size[0] / size[1]),
+                      reducing_gap=REDUCING_GAP)
+
+
+def save_original(data, img, base_path):
+    """Keep the downloaded original next to the gallery image and return its path.
+
+    Bytes already in a compressed format are written untouched; anything else
+    is re-encoded as PNG.
+    """
+    ext = COMPRESSED_FORMATS.get(img.format)
+    if ext:
+        path = base_path + ext
+        atomic_file.write(path, data)
+    else:
+        path = base_path + '.png'
+        with atomic_file.open_atomic(path) as f:
+            img.save(f, format='PNG', optimize=True)
+    return path
+
+
+def save_bmp(img, path):
+    """Write img as a BMP and return the SHA-1 of the written bytes"""
+    out = io.BytesIO()
+    img.save(out, format='BMP')
+    encoded = out.getvalue()
+    # Written atomically so an interrupted run never leaves a truncated image
+    atomic_file.write(path, encoded)
+    return hashlib.sha1(encoded).digest()
+
+
+def process_download(data, display_path, original_base=None, size=DISPLAY_SIZE):
+    """Decode downloaded image bytes once and write the display-sized BMP.
+
+    If original_base is given the original is also kept there (see
+    save_original). Returns (display image, SHA-1 of the written BMP,
+    original path or None) so callers can pack the panel buffer without
+    reading the file back.
+    """
+    img = decode(data, size)
+    logger.info(f"Decoded {img.format} {img.size[0]}x{img.size[1]} image")
+    display_img = fit_display(img, size)
+    sha1 = save_bmp(display_img, display_path)
+    logger.info(f"Display image saved to {display_path}")
+
+    original_path = None
+    if original_base:
+        original_path = save_original(data, img, original_base)
+        logger.info(f"Original saved to {original_path}")
+    return display_img, sha1, original_path
@@ -0,0 +1,244 @@
+"""Shared store for image descriptions (gallery filename -> description).
+
+The web app, the quiz and pack_gallery.py all write to it. The store is an
+append-only journal next to a snapshot:
+
+    image_metadata.json          snapshot, the whole map as JSON
+    image_metadata.json.journal  one JSON line per change since the snapshot
+
+Loading reads the snapshot and replays the journal over it. After that only
+journal lines added since the last read (by this process or another one)
+are read, so a lookup costs two stats unless something changed.
+
+Writes are batched: set() and delete() are visible to readers in this
+process at once and are appended together flush_delay seconds later (or on
+flush()), under an exclusive flock on a sidecar .lock file. An edit costs
+one short append and an fsync however large the gallery is. A power cut can
+only lose or cut off the last line, which replay skips.
+
+Once the journal passes compact_size bytes it is folded into a new snapshot
+on a background thread. The snapshot is replaced atomically first and the
+journal emptied second. Replaying a journal over a snapshot that already
+contains it gives the same map, so a crash between the two steps loses
+nothing.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import atomic_file
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = '/home/pi/rpi-screen/image_metadata.json'
+COMPACT_SIZE = 256 * 1024
+
+_DELETED = object()
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _replay(data, chunk):
+    """Apply the complete journal lines in chunk to data; returns the bytes consumed"""
+    end = chunk.rfind(b'\n') + 1
+    for line in chunk[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            filename, description = entry['filename'], entry['description']
+        except (ValueError, KeyError, TypeError):
+            # A line cut off by a crash, followed by the next writer's newline
+            logger.warning(f"Skipping damaged metadata journal line: {line[:80]!r}")
+            continue
+        if description is None:
+            data.pop(filename, None)
+        else:
+            data[filename] = description
+    return end
+
+
+class MetadataStore:
+    """Image descriptions, cached in memory and journaled in batches"""
+
+    def __init__(self, path=METADATA_FILE, flush_delay=0.5, compact_size=COMPACT_SIZE):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.lock_path = path + '.lock'
+        self.flush_delay = flush_delay
+        self.compact_size = compact_size
+        self.lock = threading.RLock()
+        self.data = {}
+        # Snapshot (ino, size, mtime) and journal inode that data was loaded from,
+        # and how far into that journal has been replayed
+        self.snapshot_signature = None
+        self.journal_ino = None
+        self.journal_offset = 0
+        # filename -> description, or _DELETED
+        self.pending = {}
+        self.timer = None
+        self.compactor = None
+        # Bumped whenever the map may have changed, see version()
+        self.changes = 0
+        atexit.register(self.flush)
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _refresh(self):
+        """Catch up with the snapshot and journal if they changed on disk"""
+        snapshot = _stat(self.path)
+        journal = _stat(self.journal_path)
+        journal_ino, journal_size = journal[:2] if journal else (None, 0)
+        try:
+            if snapshot != self.snapshot_signature or journal_ino != self.journal_ino \
+                    or journal_size < self.journal_offset:
+                # New snapshot or compacted journal: load both from scratch
+                data = self._read_snapshot()
+                offset = 0
+            elif journal_size > self.journal_offset:
+                data = self.data
+                offset = self.journal_offset
+            else:
+                return
+            if journal_size > offset:
+                with open(self.journal_path, 'rb') as f:
+                    f.seek(offset)
+                    offset += _replay(data, f.read(journal_size - offset))
+        except (OSError, ValueError) as e:
+            # Keep the last good copy; a writer may have left a broken snapshot behind
+            logger.error(f"Error loading metadata: {e}")
+            return
+        self.data = data
+        self.snapshot_signature = snapshot
+        self.journal_ino = journal_ino
+        self.journal_offset = offset
+        self.changes += 1
+
+    def version(self):
+        """A number that changes whenever descriptions may have changed, here or on disk"""
+        with self.lock:
+            self._refresh()
+            return self.changes
+
+    def snapshot(self):
+        """Current map including changes not yet flushed, as a new dict"""
+        with self.lock:
+            self._refresh()
+            data = dict(self.data)
+            for filename, description in self.pending.items():
+                if description is _DELETED:
+                    data.pop(filename, None)
+                else:
+                    data[filename] = description
+            return data
+
+    def get(self, filename, default=None):
+        with self.lock:
+            if filename in self.pending:
+                description = self.pending[filename]
+                return default if description is _DELETED else description
+            self._refresh()
+            return self.data.get(filename, default)
+
+    def __contains__(self, filename):
+        return self.get(filename, _DELETED) is not _DELETED
+
+    def set(self, filename, description):
+        self._queue(filename, description)
+
+    def delete(self, filename):
+        self._queue(filename, _DELETED)
+
+    def _queue(self, filename, value):
+        with self.lock:
+            self.pending[filename] = value
+            self.changes += 1
+            if self.flush_delay <= 0:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Append pending changes to the journal now"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending:
+                return True
+            lines = b''.join(
+                json.dumps({'filename': filename,
+                            'description': None if description is _DELETED else description}).encode() + b'\n'
+                for filename, description in self.pending.items())
+            try:
+                with open(self.lock_path, 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    journal_size = self._append(lines)
+            except OSError as e:
+                logger.error(f"Error saving metadata: {e}")
+                return False
+            self.pending.clear()
+            # Picks up our lines together with any appended by other processes
+            self._refresh()
+        if journal_size > self.compact_size:
+            self.compact_in_background()
+        return True
+
+    def _append(self, lines):
+        """Append lines to the journal and make them durable; returns its new size"""
+        fd = os.open(self.journal_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            # A crash mid-append leaves a line without its newline; end it first
+            if size and os.pread(fd, 1, size - 1) != b'\n':
+                lines = b'\n' + lines
+            os.write(fd, lines)
+            os.fsync(fd)
+            return size + len(lines)
+        finally:
+            os.close(fd)
+
+    def compact_in_background(self):
+        with self.lock:
+            if self.compactor is not None and self.compactor.is_alive():
+                return
+            self.compactor = threading.Thread(target=self.compact, name='metadata-compact', daemon=True)
+            self.compactor.start()
+
+    def compact(self):
+        """Fold the journal into a new snapshot and start an empty journal"""
+        # Only the file lock is taken here: flush() holds self.lock while it waits
+        # for the file lock, and this process re-reads both files on its next lookup
+        try:
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                journal = _stat(self.journal_path)
+                if journal is None or journal[1] == 0:
+                    return
+                data = self._read_snapshot()
+                with open(self.journal_path, 'rb') as f:
+                    _replay(data, f.read())
+                self._write(self.path, json.dumps(data, indent=2).encode())
+                self._write(self.journal_path, b'')
+                logger.info(f"Compacted {journal[1]} byte metadata journal into a snapshot of {len(data)} entries")
+        except (OSError, ValueError) as e:
+            logger.error(f"Error compacting metadata journal: {e}")
+
+    def _write(self, path, content):
+        # sync_dir makes the rename itself durable before the next step relies on it
+        atomic_file.write(path, content, sync_dir=True)
@@ -0,0 +1,69 @@
+"""In-process counters and timing summaries.
+
+Modules record what they measure into the shared REGISTRY:
+
+    metrics.REGISTRY.incr('download.bytes', len(data))
+    metrics.REGISTRY.observe('download.throughput_kbps', kbps)
+
+and the web app reports REGISTRY.snapshot() at /metrics. Observations keep
+a count, sum, min, max and the last value rather than every sample, so
+recording costs the same however long the process runs.
+"""
+import threading
+
+
+class Summary:
+    """Running count, sum, min, max and last value of observations"""
+
+    __slots__ = ('count', 'total', 'min', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'last': self.last,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.summaries = {}
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            summary = self.summaries.get(name)
+            if summary is None:
+                summary = self.summaries[name] = Summary()
+            summary.add(value)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'summaries': {name: summary.to_dict() for name, summary in self.summaries.items()},
+            }
+
+
+REGISTRY = Metrics()
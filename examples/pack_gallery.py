@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Convert the gallery's ai_*_resized*.bmp files to the compact .epd format.
+
+Each BMP gets a packed_image file next to it with the same name and a .epd
+extension, holding the 2 bpp panel buffer (about 11.7 KB instead of 139 KB).
+The image's description in image_metadata.json is copied to the new name.
+BMPs whose .epd is already current (same source hash, panel, depth and
+dither method) are skipped. With --delete the BMPs are removed once converted,
+along with their metadata keys.
+
+    python pack_gallery.py [--delete] [--bpp 1|2] [--dither METHOD] [--panel MODEL]
+"""
+import argparse
+import os
+import re
+import sys
+import dither
+import image_pipeline
+import packed_image
+import panels
+from metadata_store import MetadataStore, METADATA_FILE
+from render_cache import file_sha1
+
+IMAGES_DIR = '/home/pi/rpi-screen/images'
+
+GALLERY_PATTERN = re.compile(r'^ai_(hp|custom).*resized.*\.bmp$')
+
+
+def is_current(target, sha1, panel, bpp, dither_method):
+    try:
+        header = packed_image.read_header(target)
+    except (FileNotFoundError, packed_image.PackedImageError):
+        return False
+    return (header.source_sha1 == sha1 and header.panel == panel and header.bpp == bpp
+            and header.dither == dither_method)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--images-dir', default=IMAGES_DIR)
+    parser.add_argument('--metadata', default=METADATA_FILE)
+    parser.add_argument('--bpp', type=int, choices=sorted(packed_image.MODES), default=2)
+    parser.add_argument('--dither', default='none', choices=dither.METHODS)
+    parser.add_argument('--delete', action='store_true', help='remove each BMP once it is converted')
+    parser.add_argument('--panel', default=os.getenv('EPD_PANEL', panels.DEFAULT_PANEL),
+                        help=f"panel model to pack for: {', '.join(panels.PROFILES)}")
+    args = parser.parse_args()
+    try:
+        profile = panels.get_profile(args.panel)
+    except ValueError as e:
+        parser.error(str(e))
+    if not profile.supports(packed_image.MODES[args.bpp]):
+        parser.error(f"{profile.model} cannot show {packed_image.MODES[args.bpp]} images")
+
+    names = sorted(name for name in os.listdir(args.images_dir) if GALLERY_PATTERN.match(name))
+    metadata = MetadataStore(args.metadata)
+    converted = skipped = failed = 0
+    bytes_before = bytes_after = 0
+
+    for name in names:
+        source = os.path.join(args.images_dir, name)
+        target_name = os.path.splitext(name)[0] + packed_image.EXTENSION
+        target = os.path.join(args.images_dir, target_name)
+        try:
+            sha1 = file_sha1(source)
+            if is_current(target, sha1, profile.model, args.bpp, args.dither):
+                skipped += 1
+            else:
+                with packed_image.open_image(source) as img:
+                    img = image_pipeline.fit_display(img, profile.display_size)
+                    packed_image.write(target, img, profile.model, profile.width, profile.height,
+                                       args.bpp, sha1, args.dither)
+                # Keep the BMP's mtime so the gallery's newest-first order is unchanged
+                st = os.stat(source)
+                os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+                converted += 1
+                print(f"{name} -> {target_name}")
+        except Exception as e:
+            failed += 1
+            print(f"{name}: FAILED: {e}", file=sys.stderr)
+            continue
+
+        bytes_before += os.path.getsize(source)
+        bytes_after += os.path.getsize(target)
+        if name in metadata and target_name not in metadata:
+            metadata.set(target_name, metadata.get(name))
+        if args.delete:
+            os.remove(source)
+            metadata.delete(name)
+
+    # Merged with descriptions the app or the quiz wrote meanwhile
+    metadata.flush()
+    print(f"{converted} converted, {skipped} already current, {failed} failed; "
+          f"{bytes_before / 1024:.0f} KB of BMPs -> {bytes_after / 1024:.0f} KB packed")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Compact on-disk format for gallery images: the packed panel buffer plus a small header.
+
+A 264x176 gallery image is ~139 KB as a 24-bit BMP but only 11.6 KB at the
+2 bits per pixel the panel can show. A .epd file stores exactly the buffer
+display_4Gray (2 bpp) or display (1 bpp) expects, so showing it is one small
+read with no decoding, and it can still be turned back into an image for
+thumbnails or other render modes.
+
+Header (little-endian): magic, version, image width, height, bits per pixel,
+rotation applied to reach panel orientation, panel model and dither method
+(both NUL-padded), SHA-1 of the file it was made from, payload length.
+Version 1 files, which have no dither method, can still be read.
+"""
+import collections
+import struct
+import numpy as np
+from PIL import Image
+import atomic_file
+import epd_render
+
+EXTENSION = '.epd'
+HEADER = struct.Struct('<4sBHHBH16s16s20sI')
+HEADER_V1 = struct.Struct('<4sBHHBH16s20sI')
+MAGIC = b'EPDI'
+VERSION = 2
+
+# Bits per pixel -> render mode the payload is a buffer for
+MODES = {2: '4gray', 1: '1bit'}
+
+# dither is None for version 1 files, which did not record it
+PackedHeader = collections.namedtuple('PackedHeader', 'width height bpp rotation panel dither source_sha1')
+
+
+class PackedImageError(ValueError):
+    pass
+
+
+def is_packed(path):
+    return path.endswith(EXTENSION)
+
+
+def pack(img, width, height, bpp=2, dither_method='none'):
+    """Panel buffer for img on a width x height (portrait) panel at the given depth"""
+    if bpp == 2:
+        return epd_render.render_4gray(img, width, height, dither_method)
+    if bpp == 1:
+        return epd_render.render_1bit(img, width, height, dither_method)
+    raise PackedImageError(f"Unsupported bit depth: {bpp}")
+
+
+def write(path, img, panel, width, height, bpp=2, source_sha1=b'', dither_method='none'):
+    """Pack img for the panel and write it to path atomically"""
+    payload = bytes(pack(img, width, height, bpp, dither_method))
+    # Stored in landscape like the gallery BMPs; portrait panels get it rotated 90 degrees
+    rotation = 0 if width >= height else 90
+    size = (width, height) if rotation == 0 else (height, width)
+    header = HEADER.pack(MAGIC, VERSION, *size, bpp, rotation, panel.encode(), dither_method.encode(),
+                         source_sha1.ljust(20, b'\0'), len(payload))
+    with atomic_file.open_atomic(path) as f:
+        f.write(header)
+        f.write(payload)
+    return len(header) + len(payload)
+
+
+def _parse_header(path, data):
+    """Return (PackedHeader, header size, payload length)"""
+    if len(data) < HEADER_V1.size:
+        raise PackedImageError(f"{path}: truncated header")
+    magic, version = data[:4], data[4]
+    if magic != MAGIC or version not in (1, VERSION):
+        raise PackedImageError(f"{path}: not a packed image (version {VERSION})")
+    if version == 1:
+        width, height, bpp, rotation, panel, sha1, length = HEADER_V1.unpack_from(data)[2:]
+        return PackedHeader(width, height, bpp, rotation, panel.rstrip(b'\0').decode(), None, sha1), \
+            HEADER_V1.size, length
+    if len(data) < HEADER.size:
+        raise PackedImageError(f"{path}: truncated header")
+    width, height, bpp, rotation, panel, dither_method, sha1, length = HEADER.unpack_from(data)[2:]
+    return PackedHeader(width, height, bpp, rotation, panel.rstrip(b'\0').decode(),
+                        dither_method.rstrip(b'\0').decode(), sha1), HEADER.size, length
+
+
+def _panel_shape(header):
+    """(rows, columns) of the payload, i.e. the image in panel orientation"""
+    if header.rotation in (90, 270):
+        return header.width, header.height
+    return header.height, header.width
+
+
+def _stride(cols, bpp):
+    """Bytes per payload row; rows are padded to whole bytes like the driver's buffers"""
+    return (cols * bpp + 7) // 8
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        return _parse_header(path, f.read(HEADER.size))[0]
+
+
+def read(path):
+    """Return (PackedHeader, payload bytes)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    header, offset, length = _parse_header(path, data)
+    payload = data[offset:]
+    rows, cols = _panel_shape(header)
+    if len(payload) != length or length != rows * _stride(cols, header.bpp):
+        raise PackedImageError(f"{path}: payload is {len(payload)} bytes, expected {length}")
+    return header, payload
+
+
+def to_image(header, payload):
+    """Decode a payload back into an 'L' image at its stored size"""
+    bpp = header.bpp
+    levels = (1 << bpp) - 1
+    rows, cols = _panel_shape(header)
+    packed = np.frombuffer(payload, dtype=np.uint8).reshape(rows, _stride(cols, bpp))
+    shifts = np.arange(8 - bpp, -1, -bpp, dtype=np.uint8)
+    codes = ((packed[:, :, None] >> shifts) & levels).reshape(rows, -1)[:, :cols]
+    gray = (codes * (255 // levels)).astype(np.uint8)
+    # Undo the counter-clockwise rotation applied when packing
+    gray = np.rot90(gray, -header.rotation // 90)
+    return Image.fromarray(np.ascontiguousarray(gray), 'L')
+
+
+def open_image(path):
+    """Open a gallery image of either format as a PIL image"""
+    if is_packed(path):
+        return to_image(*read(path))
+    return Image.open(path)
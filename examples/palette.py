@@ -0,0 +1,112 @@
+"""Palette quantization and 4bpp packing for the 7-color ACeP panels.
+
+The epd7in3f, epd5in65f and epd4in01f drivers (and the 6-color epd7in3e)
+turn an RGB image into their buffer in getbuffer: PIL quantize against the
+panel palette, then a Python loop that packs two pixels per byte, which
+takes tens of seconds for an 800x480 frame on a Pi Zero. Here the nearest
+palette color of every RGB value is precomputed once in a 3D lookup table
+(6 bits per channel, 256 KB), so quantizing is a single NumPy indexing
+step, and the codes are packed with array shifts.
+
+    render(img, width, height, dither_method, palette) -> display() buffer
+
+Dithering uses the methods of dither.py: Bayer offsets each channel before
+the lookup, and error diffusion runs the same wavefront as for gray levels
+with the error carried per channel.
+"""
+import functools
+import logging
+
+import numpy as np
+
+import dither
+
+logger = logging.getLogger(__name__)
+
+# Panel color code -> RGB, in code order; None marks a code the panel doesn't use
+PALETTES = {
+    # epd7in3f, epd5in65f, epd4in01f: black, white, green, blue, red, yellow, orange
+    'acep7': ((0, 0, 0), (255, 255, 255), (0, 255, 0), (0, 0, 255), (255, 0, 0), (255, 255, 0), (255, 128, 0)),
+    # epd7in3e: black, white, yellow, red, (unused), blue, green
+    'spectra6': ((0, 0, 0), (255, 255, 255), (255, 255, 0), (255, 0, 0), None, (0, 0, 255), (0, 255, 0)),
+}
+
+LUT_BITS = 6
+# Bayer offsets span this much of each channel: a full step between the
+# primaries, which gave the lowest average color error on test gradients
+BAYER_SPREAD = 255
+
+
+@functools.lru_cache(maxsize=None)
+def lookup_table(palette):
+    """(lut, codes, colors) for a palette name.
+
+    colors holds the RGB values the panel can show (float32) and codes their
+    panel codes; lut maps each RGB value, LUT_BITS per channel, to the index
+    of the nearest color.
+    """
+    entries = [(code, rgb) for code, rgb in enumerate(PALETTES[palette]) if rgb is not None]
+    codes = np.array([code for code, _ in entries], dtype=np.uint8)
+    colors = np.array([rgb for _, rgb in entries], dtype=np.float32)
+
+    shift = 8 - LUT_BITS
+    # Centre of each cell of the table, for every r, g, b cell
+    centres = (np.arange(1 << LUT_BITS, dtype=np.float32) * (1 << shift)) + ((1 << shift) - 1) / 2
+    grid = np.stack(np.meshgrid(centres, centres, centres, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+    distances = ((grid - colors) ** 2).sum(axis=-1)
+    lut = distances.argmin(axis=1).astype(np.uint8)
+    return lut, codes, colors
+
+
+def _cells(rgb):
+    """Lookup table index of each RGB value in an (..., 3) integer array"""
+    shift = 8 - LUT_BITS
+    rgb = rgb >> shift
+    return (rgb[..., 0] << (2 * LUT_BITS)) | (rgb[..., 1] << LUT_BITS) | rgb[..., 2]
+
+
+def quantize(img, palette='acep7', dither_method='none'):
+    """Panel color codes ((h, w) uint8) for an image, with the given dither method"""
+    lut, codes, colors = lookup_table(palette)
+    if dither_method == 'none':
+        rgb = np.asarray(img.convert('RGB'), dtype=np.uint32)
+        return codes[lut[_cells(rgb)]]
+
+    rgb = np.asarray(img.convert('RGB'), dtype=np.float32)
+    if dither_method == 'bayer':
+        h, w = rgb.shape[:2]
+        t = np.tile(dither.BAYER8 - 0.5, (h // 8 + 1, w // 8 + 1))[:h, :w]
+        rgb = np.clip(np.rint(rgb + t[:, :, None] * BAYER_SPREAD), 0, 255).astype(np.uint32)
+        return codes[lut[_cells(rgb)]]
+    if dither_method in dither.KERNELS:
+        def nearest(v):
+            return lut[_cells(np.clip(np.rint(v), 0, 255).astype(np.uint32))]
+
+        return codes[dither.diffuse(rgb, dither.KERNELS[dither_method], nearest, colors)]
+    raise ValueError(f"Unknown dither method: {dither_method}")
+
+
+def pack_4bpp(codes, width, height):
+    """Pack color codes into the layout of the ACeP drivers' getbuffer: two
+    pixels per byte, high nibble first. A landscape (height x width) array
+    is rotated into panel orientation like the driver does."""
+    if codes.shape == (height, width):
+        pass
+    elif codes.shape == (width, height):
+        codes = np.rot90(codes)
+    else:
+        logger.warning(f"Wrong image dimensions: must be {width}x{height}")
+        return bytearray([0x11] * ((width + 1) // 2 * height))
+    if width % 2:
+        codes = np.pad(codes, ((0, 0), (0, 1)), constant_values=1)
+    return bytearray(((codes[:, 0::2] << 4) | codes[:, 1::2]).tobytes())
+
+
+def render(img, width, height, dither_method='none', palette='acep7'):
+    """Resize to the panel in landscape, map to the palette and pack for display"""
+    img = img.convert('RGB')
+    landscape = (max(width, height), min(width, height))
+    if img.size != landscape:
+        img = img.resize(landscape)
+    return pack_4bpp(quantize(img, palette, dither_method), width, height)
+
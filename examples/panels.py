@@ -0,0 +1,97 @@
+"""Registry of the e-Paper panels the render pipeline can target.
+
+Each profile records what the pipeline needs to drive a panel without
+hardcoding epd2in7_V2: the native resolution (as the driver's EPD_WIDTH x
+EPD_HEIGHT), the color model, the render depths it can show (which also
+pick the buffer packing, see render_cache.DEPTHS), per refresh mode the
+driver's init call and the display call that pushes a packed buffer, and
+the name of the driver's sleep call.
+
+Gallery art is landscape, so every panel shows it at display_size, the
+native resolution turned landscape; portrait-native panels get the image
+rotated into place by the packers, as the Waveshare getbuffer functions do.
+
+Select the panel with EPD_PANEL (default epd2in7_V2).
+"""
+import collections
+import os
+
+DEFAULT_PANEL = 'epd2in7_V2'
+
+# Refresh mode -> (init method, init args, display method)
+Refresh = collections.namedtuple('Refresh', 'init init_args display')
+
+
+class PanelProfile(collections.namedtuple('PanelProfile', 'model width height color depths refresh sleep',
+                                          defaults=('sleep',))):
+    """A panel: native size, color model, render depths (preferred first), refresh modes and sleep method"""
+
+    __slots__ = ()
+
+    @property
+    def display_size(self):
+        """Size of the landscape image shown on the panel"""
+        return (max(self.width, self.height), min(self.width, self.height))
+
+    @property
+    def default_depth(self):
+        return self.depths[0]
+
+    def supports(self, mode):
+        """Whether a render mode such as '1bit-atkinson' can be shown on this panel"""
+        return mode.split('-', 1)[0] in self.depths
+
+
+def _modes(init='init', init_args=(), display='display', fast=None, gray4=None):
+    """Refresh table: a full refresh plus optional (init, display) method pairs for fast and 4-gray"""
+    modes = {'full': Refresh(init, init_args, display)}
+    if fast:
+        modes['fast'] = Refresh(fast[0], (), fast[1])
+    if gray4:
+        modes['4gray'] = Refresh(gray4[0], (), gray4[1])
+    return modes
+
+
+PROFILES = {p.model: p for p in [
+    PanelProfile('epd1in02', 80, 128, 'bw', ('1bit',), _modes('Init'), sleep='Sleep'),
+    PanelProfile('epd1in54_V2', 200, 200, 'bw', ('1bit',), _modes(init_args=(0,))),
+    PanelProfile('epd2in13_V3', 122, 250, 'bw', ('1bit',), _modes()),
+    PanelProfile('epd2in13_V4', 122, 250, 'bw', ('1bit',), _modes(fast=('init_fast', 'display_fast'))),
+    PanelProfile('epd2in66', 152, 296, 'bw', ('1bit',), _modes(init_args=(0,))),
+    PanelProfile('epd2in7', 176, 264, 'gray4', ('4gray', '1bit'), _modes(gray4=('Init_4Gray', 'display_4Gray'))),
+    PanelProfile('epd2in7_V2', 176, 264, 'gray4', ('4gray', '1bit'), {
+        # display_Base also writes the "old" RAM display_Partial diffs against
+        'full': Refresh('init', (), 'display_Base'),
+        'fast': Refresh('init_Fast', (), 'display_Fast'),
+        'partial': Refresh('init', (), 'display_Partial'),
+        '4gray': Refresh('Init_4Gray', (), 'display_4Gray'),
+    }),
+    PanelProfile('epd2in9_V2', 128, 296, 'gray4', ('4gray', '1bit'),
+                 _modes(fast=('init_Fast', 'display'), gray4=('Init_4Gray', 'display_4Gray'))),
+    PanelProfile('epd3in7', 280, 480, 'gray4', ('4gray', '1bit'), {
+        'full': Refresh('init', (1,), 'display_1Gray'),
+        '4gray': Refresh('init', (0,), 'display_4Gray'),
+    }),
+    PanelProfile('epd4in2_V2', 400, 300, 'gray4', ('4gray', '1bit'), _modes(gray4=('Init_4Gray', 'display_4Gray'))),
+    PanelProfile('epd4in26', 800, 480, 'gray4', ('4gray', '1bit'),
+                 _modes(fast=('init_Fast', 'display_Fast'), gray4=('init_4GRAY', 'display_4Gray'))),
+    PanelProfile('epd5in83_V2', 648, 480, 'bw', ('1bit',), _modes()),
+    PanelProfile('epd7in5_V2', 800, 480, 'gray4', ('4gray', '1bit'),
+                 _modes(fast=('init_fast', 'display'), gray4=('init_4Gray', 'display_4Gray'))),
+    PanelProfile('epd7in5_HD', 880, 528, 'bw', ('1bit',), _modes()),
+    PanelProfile('epd13in3k', 960, 680, 'gray4', ('4gray', '1bit'), _modes(gray4=('init_4GRAY', 'display_4Gray'))),
+    # Color panels: one full refresh of a 4bpp buffer (see palette.py)
+    PanelProfile('epd4in01f', 640, 400, 'acep7', ('acep7',), _modes()),
+    PanelProfile('epd5in65f', 600, 448, 'acep7', ('acep7',), _modes()),
+    PanelProfile('epd7in3f', 800, 480, 'acep7', ('acep7',), _modes()),
+    PanelProfile('epd7in3e', 800, 480, 'spectra6', ('spectra6',), _modes()),
+]}
+
+
+def get_profile(model=None):
+    """Profile for model, or for EPD_PANEL if model is None"""
+    model = model or os.getenv('EPD_PANEL', DEFAULT_PANEL)
+    try:
+        return PROFILES[model]
+    except KeyError:
+        raise ValueError(f"Unknown panel: {model} (known: {', '.join(PROFILES)})")
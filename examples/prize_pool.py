@@ -0,0 +1,154 @@
+"""Prize images generated ahead of time, so the quiz can show one at once.
+
+A PrizePool keeps up to size images per topic ready to display: generated,
+written to the gallery and packed into a panel buffer. Slots are refilled
+on background threads, at most max_workers generations at a time, and only
+once the panel has been left alone for idle_delay seconds (touch() marks
+activity), so a refill never competes with a refresh. take() hands out a
+ready slot at once and the refill of that slot starts in the background.
+
+The filenames of ready images are kept in prize_pool.json, so a restart
+only has to re-pack them rather than generate them again.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import atomic_file
+
+logger = logging.getLogger(__name__)
+
+POOL_FILE = '/home/pi/rpi-screen/prize_pool.json'
+
+
+class PrizePool:
+    """Per-topic pools of ready-to-display images.
+
+    generate(topic) makes a new image and returns its path;
+    pack(path) returns the panel buffer for it.
+    """
+
+    def __init__(self, generate, pack, size=2, max_workers=1, idle_delay=3, state_file=POOL_FILE):
+        self.generate = generate
+        self.pack = pack
+        self.size = size
+        self.max_workers = max_workers
+        self.idle_delay = idle_delay
+        self.state_file = state_file
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prize')
+        self.cond = threading.Condition()
+        # topic -> [(path, buf), ...] ready to show
+        self.ready = {}
+        # topic -> generations in progress
+        self.inflight = {}
+        self.last_activity = 0
+        self.saved = self._load()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='prize-pool', daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading prize pool: {e}")
+            return {}
+
+    def _save(self):
+        """Write the ready filenames per topic; called with self.cond held"""
+        # Topics not wanted by this run keep what an earlier run saved for them
+        state = dict(self.saved)
+        state.update({topic: [path for path, _ in slots] for topic, slots in self.ready.items()})
+        self.saved = state
+        try:
+            atomic_file.write(self.state_file, json.dumps(state, indent=2))
+        except OSError as e:
+            logger.error(f"Error saving prize pool: {e}")
+
+    def want(self, topic):
+        """Start keeping a pool for topic, re-packing images saved by an earlier run"""
+        with self.cond:
+            if topic in self.ready:
+                return
+            saved = [path for path in self.saved.get(topic, []) if os.path.exists(path)]
+        slots = []
+        for path in saved[:self.size]:
+            try:
+                slots.append((path, self.pack(path)))
+            except Exception as e:
+                logger.warning(f"Dropping prize {os.path.basename(path)}: {e}")
+        with self.cond:
+            if topic in self.ready:
+                return
+            self.ready[topic] = slots
+            self.inflight[topic] = 0
+            self._save()
+            self.cond.notify_all()
+        logger.info(f"Prize pool for '{topic}': {len(slots)} of {self.size} ready")
+
+    def take(self, topic):
+        """A ready (path, buf) for topic, or None if the pool is empty. The slot is refilled in the background."""
+        with self.cond:
+            slots = self.ready.get(topic)
+            if not slots:
+                return None
+            slot = slots.pop(0)
+            self._save()
+            self.cond.notify_all()
+        logger.info(f"Prize {os.path.basename(slot[0])} taken from the pool for '{topic}'")
+        return slot
+
+    def touch(self):
+        """Mark panel activity; refills wait until it has been idle for idle_delay seconds"""
+        with self.cond:
+            self.last_activity = time.monotonic()
+
+    def stop(self):
+        with self.cond:
+            self._stop = True
+            self.cond.notify_all()
+        # _run never submits more refills than there are workers, so none are
+        # left queued to cancel (shutdown's cancel_futures needs Python 3.9)
+        self.executor.shutdown(wait=False)
+
+    def _run(self):
+        with self.cond:
+            while not self._stop:
+                idle_for = time.monotonic() - self.last_activity
+                if idle_for < self.idle_delay:
+                    self.cond.wait(self.idle_delay - idle_for)
+                    continue
+                started = False
+                for topic, slots in self.ready.items():
+                    if sum(self.inflight.values()) >= self.max_workers:
+                        break
+                    if len(slots) + self.inflight[topic] < self.size:
+                        self.inflight[topic] += 1
+                        self.executor.submit(self._refill, topic)
+                        started = True
+                if not started:
+                    self.cond.wait()
+
+    def _refill(self, topic):
+        slot = None
+        try:
+            logger.info(f"Generating a prize for '{topic}'")
+            path = self.generate(topic)
+            slot = (path, self.pack(path))
+        except Exception as e:
+            logger.error(f"Error generating a prize for '{topic}': {e}")
+        with self.cond:
+            self.inflight[topic] -= 1
+            if slot is not None:
+                self.ready[topic].append(slot)
+                self._save()
+                logger.info(f"Prize pool for '{topic}': {len(self.ready[topic])} of {self.size} ready")
+            else:
+                # Back off before trying again so a failing API isn't called in a loop
+                self.last_activity = time.monotonic() + 60
+            self.cond.notify_all()
@@ -0,0 +1,166 @@
+import functools
+import hashlib
+import logging
+import os
+import struct
+import atomic_file
+import dither
+import epd_render
+import image_pipeline
+import packed_image
+import palette
+import panels
+
+logger = logging.getLogger(__name__)
+
+# Cache file header: magic, version, source size, source mtime (ns), source SHA-1, payload length
+HEADER = struct.Struct('<4sBQQ20sI')
+MAGIC = b'EPDC'
+VERSION = 1
+
+# Bit depths: name -> fn(img, width, height, dither_method) returning the packed panel buffer.
+# The color panels' depths are named after their palette (see palette.PALETTES)
+DEPTHS = {
+    '4gray': epd_render.render_4gray,
+    '1bit': epd_render.render_1bit,
+    'acep7': functools.partial(palette.render, palette='acep7'),
+    'spectra6': functools.partial(palette.render, palette='spectra6'),
+}
+
+
+def render_mode(depth='4gray', dither_method='none'):
+    """Name of the render mode for a bit depth and dither method, validating both"""
+    if depth not in DEPTHS:
+        raise ValueError(f"Unknown depth: {depth} (expected one of {', '.join(DEPTHS)})")
+    if dither_method not in dither.METHODS:
+        raise ValueError(f"Unknown dither method: {dither_method} (expected one of {', '.join(dither.METHODS)})")
+    return depth if dither_method == 'none' else f'{depth}-{dither_method}'
+
+
+# Render modes: name -> fn(img, width, height). '4gray' and '1bit' threshold,
+# '<depth>-<method>' dithers, e.g. '1bit-atkinson'
+RENDERERS = {render_mode(depth, method): functools.partial(render, dither_method=method)
+             for depth, render in DEPTHS.items() for method in dither.METHODS}
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+class RenderCache:
+    """Panel-ready packed buffers for gallery images, stored in a cache directory.
+
+    Each entry is keyed by the source file's hash, the panel model (see
+    panels.PanelProfile) and the render mode, so displaying a cached image
+    is one small file read. The source's size and mtime are kept alongside
+    the hash so the common case is validated with a stat instead of
+    re-hashing the source.
+    """
+
+    def __init__(self, cache_dir, profile=None):
+        self.cache_dir = cache_dir
+        self.profile = profile or panels.get_profile(panels.DEFAULT_PANEL)
+        self.panel = self.profile.model
+        self.width = self.profile.width
+        self.height = self.profile.height
+
+    def path_for(self, source, mode):
+        return os.path.join(self.cache_dir, f"{os.path.basename(source)}.{self.panel}.{mode}.bin")
+
+    def load(self, source, mode):
+        """Return the cached buffer for source, or None if missing or stale"""
+        cache_path = self.path_for(source, mode)
+        try:
+            with open(cache_path, 'rb') as f:
+                header = f.read(HEADER.size)
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+        if len(header) != HEADER.size:
+            return None
+        magic, version, size, mtime_ns, sha1, length = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or length != len(payload):
+            return None
+
+        st = os.stat(source)
+        if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+            # Touched or replaced: only stale if the content actually changed
+            if file_sha1(source) != sha1:
+                return None
+            self._write(cache_path, st, sha1, payload)
+        return payload
+
+    def build(self, source, mode):
+        """Render source for the panel and store the result"""
+        logger.info(f"Rendering {os.path.basename(source)} ({mode}) into cache")
+        st = os.stat(source)
+        sha1 = file_sha1(source)
+        with packed_image.open_image(source) as img:
+            payload = self.render(img, mode)
+        self._write(self.path_for(source, mode), st, sha1, payload)
+        return payload
+
+    def render(self, img, mode):
+        """Crop and resize img to the panel's landscape size and pack it in mode"""
+        if not self.profile.supports(mode):
+            raise ValueError(f"{self.panel} cannot show {mode} images")
+        img = image_pipeline.fit_display(img, self.profile.display_size)
+        return bytes(RENDERERS[mode](img, self.width, self.height))
+
+    def store(self, source, mode, payload, sha1=None):
+        """Cache a buffer the caller already rendered from source.
+
+        sha1 may be passed when the caller still has the bytes it wrote to
+        source, to avoid reading the file back.
+        """
+        st = os.stat(source)
+        self._write(self.path_for(source, mode), st, sha1 or file_sha1(source), bytes(payload))
+
+    def native_payload(self, source, mode):
+        """The buffer a .epd source already holds, if it is for this panel and mode"""
+        if not packed_image.is_packed(source):
+            return None
+        header, payload = packed_image.read(source)
+        if self._is_native(header, mode):
+            return payload
+        return None
+
+    def _is_native(self, header, mode):
+        """Whether a .epd header is for this panel and exactly this render mode"""
+        if header.panel != self.panel or header.bpp not in packed_image.MODES:
+            return False
+        # Version 1 files did not record a dither method; they are taken as undithered
+        return render_mode(packed_image.MODES[header.bpp], header.dither or 'none') == mode
+
+    def has(self, source, mode):
+        """Whether a buffer for source is ready, without validating it against the source"""
+        if packed_image.is_packed(source):
+            try:
+                header = packed_image.read_header(source)
+            except (OSError, packed_image.PackedImageError):
+                return False
+            if self._is_native(header, mode):
+                return True
+        return os.path.exists(self.path_for(source, mode))
+
+    def get(self, source, mode='4gray'):
+        """Return the packed buffer for source, rendering and caching it if needed"""
+        payload = self.native_payload(source, mode)
+        if payload is not None:
+            return payload
+        payload = self.load(source, mode)
+        if payload is None:
+            payload = self.build(source, mode)
+        return payload
+
+    def _write(self, cache_path, st, sha1, payload):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        header = HEADER.pack(MAGIC, VERSION, st.st_size, st.st_mtime_ns, sha1, len(payload))
+        # Written atomically so readers never see a partial entry
+        with atomic_file.open_atomic(cache_path) as f:
+            f.write(header)
+            f.write(payload)
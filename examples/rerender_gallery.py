@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Re-render the whole gallery into display-ready and packed forms on all cores.
+
+For every gallery image this fills the render cache (images/.cache) for the
+requested render modes and panels (see panels.py). With --resize the
+264x176 display images are first rebuilt from the kept originals with the
+current image_pipeline settings, e.g. after changing the crop or resize.
+Panels larger than the display images are rendered from the kept original
+when there is one.
+
+Work that is already current is skipped: packed buffers are checked against
+the render cache, and rebuilt display images are recorded in a manifest
+together with the pipeline settings used. Every output is written
+atomically, so an interrupted run can simply be started again.
+
+    python rerender_gallery.py [--resize] [--modes 4gray,1bit-atkinson] [--panels epd2in7_V2,epd7in5_V2] [--workers N]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import atomic_file
+import image_pipeline
+import packed_image
+import panels
+from render_cache import RenderCache, RENDERERS
+
+IMAGES_DIR = '/home/pi/rpi-screen/images'
+MANIFEST = 'rerender_manifest.json'
+
+RESIZED_PATTERN = re.compile(r'^ai_(hp|custom).*resized.*\.(bmp|epd)$')
+
+
+def pipeline_settings():
+    """The image_pipeline settings a display image depends on"""
+    return {'size': list(image_pipeline.DISPLAY_SIZE), 'reducing_gap': image_pipeline.REDUCING_GAP}
+
+
+def scan_gallery(images_dir):
+    """Map each gallery image name to the name of its kept original, or None"""
+    gallery = {}
+    originals = {}
+    with os.scandir(images_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if RESIZED_PATTERN.match(entry.name):
+                gallery.setdefault(entry.name, None)
+            else:
+                name = image_pipeline.resized_name(entry.name)
+                if name:
+                    originals[name] = entry.name
+    for name, original in originals.items():
+        # Images converted by pack_gallery.py are shown from their .epd copy instead
+        if os.path.splitext(name)[0] + packed_image.EXTENSION not in gallery:
+            gallery[name] = original
+    return gallery
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    atomic_file.write(path, json.dumps(manifest, indent=1, sort_keys=True))
+
+
+def manifest_entry(images_dir, original):
+    """What a display image was built from: the original's size/mtime and the pipeline settings"""
+    st = os.stat(os.path.join(images_dir, original))
+    return {'original': original, 'source': [st.st_size, st.st_mtime_ns], 'settings': pipeline_settings()}
+
+
+def render_one(images_dir, name, original, renditions, resize, cache_dir):
+    """Worker: rebuild one display image if asked, then pack it for each (panel, modes) rendition"""
+    start = time.perf_counter()
+    path = os.path.join(images_dir, name)
+    display_img = sha1 = None
+    if resize:
+        # Keep the display image's times (or take the original's for a new one),
+        # so the gallery's newest-first order and created dates are unchanged
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = os.stat(os.path.join(images_dir, original))
+        with open(os.path.join(images_dir, original), 'rb') as f:
+            display_img, sha1, _ = image_pipeline.process_download(f.read(), path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    for model, modes in renditions:
+        cache = RenderCache(cache_dir, panels.get_profile(model))
+        source = image_pipeline.rendition_source(path, cache.profile.display_size)
+        for mode in modes:
+            if display_img is not None and source == path:
+                cache.store(path, mode, cache.render(display_img, mode), sha1)
+            else:
+                cache.build(source, mode)
+    return time.perf_counter() - start
+
+
+def stale_modes(cache, path, modes, force):
+    """The modes whose packed buffer for path is missing or out of date"""
+    source = image_pipeline.rendition_source(path, cache.profile.display_size)
+    return [m for m in modes
+            if cache.native_payload(source, m) is None and (force or cache.load(source, m) is None)]
+
+
+def plan(images_dir, caches, gallery, manifest, resize, force):
+    """List (name, original, (panel, modes) renditions to pack, rebuild display image)
+    for work that is not current. caches maps each RenderCache to its modes."""
+    tasks = []
+    for name, original in sorted(gallery.items()):
+        path = os.path.join(images_dir, name)
+        rebuild = False
+        if original is not None:
+            if not os.path.exists(path):
+                rebuild = True
+            elif resize:
+                rebuild = force or manifest.get(name) != manifest_entry(images_dir, original)
+        if rebuild:
+            tasks.append((name, original, [(c.panel, modes) for c, modes in caches.items()], True))
+            continue
+        renditions = [(c.panel, stale) for c, modes in caches.items()
+                      for stale in [stale_modes(c, path, modes, force)] if stale]
+        if renditions:
+            tasks.append((name, original, renditions, False))
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--images-dir', default=IMAGES_DIR)
+    parser.add_argument('--modes',
+                        help=f"comma-separated render modes: {', '.join(RENDERERS)} "
+                             "(default: each panel's preferred depth)")
+    parser.add_argument('--panels', default=os.getenv('EPD_PANEL', panels.DEFAULT_PANEL),
+                        help=f"comma-separated panel models: {', '.join(panels.PROFILES)}")
+    parser.add_argument('--resize', action='store_true',
+                        help='rebuild display images from the kept originals with the current settings')
+    parser.add_argument('--force', action='store_true', help='redo work even if it is current')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    modes = args.modes.split(',') if args.modes else []
+    unknown = [m for m in modes if m not in RENDERERS]
+    if unknown:
+        parser.error(f"unknown render mode(s): {', '.join(unknown)}")
+    try:
+        profiles = [panels.get_profile(model) for model in args.panels.split(',')]
+    except ValueError as e:
+        parser.error(str(e))
+
+    cache_dir = os.path.join(args.images_dir, '.cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    caches = {}
+    for profile in profiles:
+        # Modes a panel cannot show (e.g. 4gray on a black and white panel) are skipped for it
+        panel_modes = [m for m in modes if profile.supports(m)] if modes else [profile.default_depth]
+        if panel_modes:
+            caches[RenderCache(cache_dir, profile)] = panel_modes
+    manifest_path = os.path.join(cache_dir, MANIFEST)
+    manifest = load_manifest(manifest_path)
+
+    gallery = scan_gallery(args.images_dir)
+    tasks = plan(args.images_dir, caches, gallery, manifest, args.resize, args.force)
+    print(f"{len(gallery)} images, {len(gallery) - len(tasks)} already current, "
+          f"{len(tasks)} to render with {args.workers} workers")
+    if not tasks:
+        return
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(render_one, args.images_dir, name, original, renditions, rebuild, cache_dir):
+                   (name, original, rebuild) for name, original, renditions, rebuild in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            name, original, rebuild = futures[future]
+            try:
+                elapsed = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(tasks)}] {name}: FAILED: {e}", file=sys.stderr)
+                continue
+            if rebuild:
+                # Recorded as soon as it is done, so a rerun after an interruption skips it
+                manifest[name] = manifest_entry(args.images_dir, original)
+                save_manifest(manifest_path, manifest)
+            rate = done / (time.perf_counter() - start)
+            print(f"[{done}/{len(tasks)}] {name} {elapsed * 1000:.0f} ms  "
+                  f"{rate:.1f} images/s, {(len(tasks) - done) / rate:.0f}s left")
+
+    total = time.perf_counter() - start
+    print(f"Rendered {len(tasks) - failed} images in {total:.1f}s ({(len(tasks) - failed) / total:.1f} images/s)"
+          + (f", {failed} failed" if failed else ""))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
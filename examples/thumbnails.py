@@ -0,0 +1,88 @@
+"""Small compressed previews of gallery images for the web UI.
+
+A preview is made once per source content and size and kept in the cache
+directory as {basename}.{sha1}.{width}x{height}.{webp|png}, so an unchanged
+image is served straight from disk and a replaced one gets a new file. The
+SHA-1 doubles as the HTTP ETag. The hash of each source is remembered together with its size
+and mtime, so a repeat request costs a stat rather than a re-read.
+
+WebP is about half the size of PNG for gallery art; PNG is kept for
+browsers that don't accept WebP and for Pillow builds without it.
+"""
+import contextlib
+import glob
+import logging
+import os
+import threading
+from PIL import Image, features
+import atomic_file
+import packed_image
+from render_cache import file_sha1
+
+logger = logging.getLogger(__name__)
+
+# The gallery page shows previews at 132x88, half the panel resolution
+THUMB_SIZE = (132, 88)
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'png': ('PNG', 'image/png')}
+WEBP_QUALITY = 80
+
+
+def webp_supported():
+    return features.check('webp')
+
+
+class ThumbnailCache:
+    """Previews of gallery images, generated on first request and kept on disk"""
+
+    def __init__(self, cache_dir, size=THUMB_SIZE):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.lock = threading.Lock()
+        # source path -> (size, mtime_ns, sha1 hex)
+        self.hashes = {}
+
+    def source_hash(self, source):
+        """Hex SHA-1 of source, re-hashed only when its size or mtime changed"""
+        st = os.stat(source)
+        key = (st.st_size, st.st_mtime_ns)
+        with self.lock:
+            known = self.hashes.get(source)
+        if known and known[:2] == key:
+            return known[2]
+        sha1 = file_sha1(source).hex()
+        with self.lock:
+            self.hashes[source] = key + (sha1,)
+        return sha1
+
+    def path_for(self, source, sha1, ext):
+        width, height = self.size
+        return os.path.join(self.cache_dir, f"{os.path.basename(source)}.{sha1[:16]}.{width}x{height}.{ext}")
+
+    def get(self, source, ext='webp'):
+        """Return (preview path, ETag) for source, making the preview if needed"""
+        if ext == 'webp' and not webp_supported():
+            ext = 'png'
+        sha1 = self.source_hash(source)
+        path = self.path_for(source, sha1, ext)
+        if not os.path.exists(path):
+            self.build(source, path, ext)
+        return path, f"{sha1[:16]}-{self.size[0]}x{self.size[1]}-{ext}"
+
+    def build(self, source, path, ext):
+        logger.info(f"Making {ext} preview of {os.path.basename(source)}")
+        with packed_image.open_image(source) as img:
+            img = img.convert('RGB') if img.mode not in ('RGB', 'L') else img.copy()
+        img.thumbnail(self.size, Image.LANCZOS)
+        fmt = FORMATS[ext][0]
+        options = {'quality': WEBP_QUALITY, 'method': 6} if fmt == 'WEBP' else {'optimize': True}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with atomic_file.open_atomic(path) as f:
+            img.save(f, fmt, **options)
+        # Drop previews of earlier versions or sizes of the same image; a
+        # concurrent build of the same preview may have removed them already
+        for old in glob.glob(os.path.join(glob.escape(self.cache_dir),
+                                          glob.escape(os.path.basename(source)) + f'.*.{ext}')):
+            if old != path:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(old)
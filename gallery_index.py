@@ -0,0 +1,259 @@
+import base64
+import bisect
+import collections
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import re
+import select
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Gallery images: ai_hp_image_resized_<ts>.bmp, ai_custom_<ts>_resized.epd, ...
+GALLERY_PATTERN = re.compile(r'^ai_(hp|custom).*resized.*\.(bmp|epd)$')
+
+# Preferred format when an image exists in both (pack_gallery.py leaves the .epd)
+FORMAT_PREFERENCE = ('.epd', '.bmp')
+
+GalleryEntry = collections.namedtuple('GalleryEntry', 'filename path mtime size kind')
+
+# inotify(7) constants
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+    | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT = struct.Struct('iIII')
+
+
+def sort_key(entry):
+    """Newest first, ties broken by filename so every entry has a fixed place"""
+    return (-entry.mtime, entry.filename)
+
+
+def cursor_for(entry):
+    """Opaque pagination cursor pointing just past entry"""
+    return base64.urlsafe_b64encode(json.dumps([entry.mtime, entry.filename]).encode()).decode()
+
+
+def parse_cursor(cursor):
+    """Sort key a cursor points past; ValueError if it is malformed"""
+    try:
+        mtime, filename = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (-float(mtime), str(filename))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class Inotify:
+    """Minimal inotify binding over libc, for watching a single directory"""
+
+    def __init__(self, path, mask=WATCH_MASK):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'inotify_add_watch failed for {path}')
+
+    def read(self, timeout):
+        """Wait up to timeout seconds and return a list of (mask, name) events"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class GalleryIndex:
+    """In-memory index of the gallery images, kept current in the background.
+
+    The directory is scanned once with os.scandir. After that an inotify
+    watch reports each added, replaced or removed file, so only that file is
+    stat'ed again. Where inotify isn't available the directory's mtime is
+    checked every rescan_interval seconds and the directory rescanned only
+    when it changed. Listing and the random rotation then work on a list sorted
+    newest first that is rebuilt only after something changed.
+    """
+
+    def __init__(self, images_dir, rescan_interval=30):
+        self.images_dir = images_dir
+        self.rescan_interval = rescan_interval
+        self.lock = threading.Lock()
+        # filename -> GalleryEntry, for every gallery file of either format
+        self.files = {}
+        self.sorted = None
+        self.dir_mtime_ns = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def scan(self):
+        """Rebuild the index from a full directory scan"""
+        files = {}
+        try:
+            dir_mtime_ns = os.stat(self.images_dir).st_mtime_ns
+            with os.scandir(self.images_dir) as entries:
+                for entry in entries:
+                    m = GALLERY_PATTERN.match(entry.name)
+                    if not m:
+                        continue
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files[entry.name] = GalleryEntry(entry.name, entry.path, st.st_mtime, st.st_size, m.group(1))
+        except FileNotFoundError:
+            dir_mtime_ns = None
+        with self.lock:
+            self.files = files
+            self.sorted = None
+            self.dir_mtime_ns = dir_mtime_ns
+        logger.info(f"Indexed {len(files)} gallery files in {self.images_dir}")
+
+    def update(self, filename):
+        """Re-stat one file after it was added, replaced or removed"""
+        m = GALLERY_PATTERN.match(filename)
+        if not m:
+            return
+        path = os.path.join(self.images_dir, filename)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            entry = None
+        else:
+            entry = GalleryEntry(filename, path, st.st_mtime, st.st_size, m.group(1))
+        with self.lock:
+            if entry is None:
+                if self.files.pop(filename, None) is None:
+                    return
+            elif self.files.get(filename) == entry:
+                return
+            else:
+                self.files[filename] = entry
+            self.sorted = None
+
+    def _sorted(self):
+        """(entries, their sort keys), newest first, rebuilt after a change"""
+        with self.lock:
+            if self.sorted is None:
+                images = {}
+                for entry in self.files.values():
+                    stem, ext = os.path.splitext(entry.filename)
+                    current = images.get(stem)
+                    if current is None or FORMAT_PREFERENCE.index(ext) < \
+                            FORMAT_PREFERENCE.index(os.path.splitext(current.filename)[1]):
+                        images[stem] = entry
+                entries = sorted(images.values(), key=sort_key)
+                self.sorted = (entries, [sort_key(entry) for entry in entries])
+            return self.sorted
+
+    def entries(self):
+        """Gallery images newest first, one per image (the .epd copy if there is one)"""
+        return self._sorted()[0]
+
+    def page(self, after=None, limit=50, include=None):
+        """Up to limit entries following the sort key after (see parse_cursor), or
+        from the newest if it is None. With include, only entries whose filename
+        is in it are returned. Returns (entries, whether more follow)."""
+        entries, keys = self._sorted()
+        # Over the precomputed keys: bisect only takes key= from Python 3.10
+        start = 0 if after is None else bisect.bisect_right(keys, after)
+        if include is None:
+            page = entries[start:start + limit + 1]
+        else:
+            page = []
+            for i in range(start, len(entries)):
+                if entries[i].filename in include:
+                    page.append(entries[i])
+                    if len(page) > limit:
+                        break
+        return page[:limit], len(page) > limit
+
+    def count(self, include=None):
+        entries = self.entries()
+        if include is None:
+            return len(entries)
+        return sum(1 for entry in entries if entry.filename in include)
+
+    def get(self, filename):
+        """Entry for an image given the filename of either of its formats, or None"""
+        stem = os.path.splitext(filename)[0]
+        with self.lock:
+            for ext in FORMAT_PREFERENCE:
+                entry = self.files.get(stem + ext)
+                if entry is not None:
+                    return entry
+        return None
+
+    def start(self):
+        """Scan now and keep the index current on a background thread"""
+        self.scan()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='gallery-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+
+    def _run(self):
+        try:
+            watch = Inotify(self.images_dir)
+        except OSError as e:
+            logger.warning(f"Not watching {self.images_dir} ({e}), rescanning every {self.rescan_interval}s")
+            self._poll()
+            return
+        logger.info(f"Watching {self.images_dir} for gallery changes")
+        try:
+            while not self._stop.is_set():
+                for mask, name in watch.read(1.0):
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were dropped; only a full scan can catch up
+                        self.scan()
+                    elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        logger.warning(f"{self.images_dir} went away, falling back to rescanning")
+                        self._poll()
+                        return
+                    elif name:
+                        self.update(name)
+        finally:
+            watch.close()
+
+    def _poll(self):
+        while not self._stop.wait(self.rescan_interval):
+            try:
+                dir_mtime_ns = os.stat(self.images_dir).st_mtime_ns
+            except FileNotFoundError:
+                dir_mtime_ns = None
+            # Adding, removing or renaming a file (which is how images are written) changes the mtime
+            if dir_mtime_ns != self.dir_mtime_ns:
+                self.scan()
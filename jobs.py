@@ -0,0 +1,114 @@
+import threading
+import time
+import uuid
+
+
+class Job:
+    """A unit of background work whose progress can be polled over HTTP.
+
+    Long-running jobs report stage-by-stage progress with add_event(); other
+    threads can block on new events or on completion.
+    """
+
+    def __init__(self, kind, description=''):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.description = description
+        self.status = 'queued'  # queued -> running -> success / error
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.events = []
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('success', 'error')
+
+    @property
+    def stage(self):
+        return self.events[-1]['stage'] if self.events else None
+
+    def add_event(self, stage, message=''):
+        with self._cond:
+            self.events.append({'time': time.time(), 'stage': stage, 'message': message})
+            self._cond.notify_all()
+
+    def mark_running(self):
+        self.status = 'running'
+        self.started = time.time()
+        self.add_event('running', 'Started')
+
+    def mark_success(self, result=None):
+        self.result = result
+        self.finished = time.time()
+        self.status = 'success'
+        self.add_event('success', 'Completed')
+
+    def mark_error(self, error):
+        self.error = str(error)
+        self.finished = time.time()
+        self.status = 'error'
+        self.add_event('error', self.error)
+
+    def events_since(self, index, timeout=None):
+        """Events after the first index ones, waiting up to timeout for new ones"""
+        with self._cond:
+            if len(self.events) <= index and not self.done:
+                self._cond.wait(timeout)
+            return self.events[index:]
+
+    def wait(self, timeout=None):
+        """Block until the job has finished; returns whether it did"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self.done:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'description': self.description,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.events[-1]['message'] if self.events else None,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobRegistry:
+    """Thread-safe lookup of recent jobs by id"""
+
+    def __init__(self, max_jobs=200):
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        # Forget the oldest finished jobs once we hold more than max_jobs
+        if len(self._jobs) <= self.max_jobs:
+            return
+        finished = sorted((j for j in self._jobs.values() if j.done), key=lambda j: j.created)
+        for job in finished[:len(self._jobs) - self.max_jobs]:
+            del self._jobs[job.id]
@@ -0,0 +1,159 @@
+import logging
+
+import numpy as np
+
+from display_session import MODE_FULL, MODE_FAST, MODE_PARTIAL
+
+logger = logging.getLogger(__name__)
+
+REFRESH_NONE = 'none'
+REFRESH_PARTIAL = 'partial'
+REFRESH_FAST = 'fast'
+REFRESH_FULL = 'full'
+
+
+def dirty_rects(old, new, width, height, max_gap=8):
+    """Byte-aligned rectangles covering every changed byte between two 1-bit buffers.
+
+    Buffers are in panel-native layout (height rows of width/8 bytes, as
+    returned by epd.getbuffer). Changed rows are grouped into bands, merging
+    bands separated by fewer than max_gap unchanged rows, and each band is
+    returned as (x0, y0, x1, y1) in panel pixels with x0/x1 multiples of 8
+    and x1/y1 exclusive, ready for epd.display_Partial.
+    """
+    stride = (width + 7) // 8
+    a = np.frombuffer(bytes(old), dtype=np.uint8).reshape(height, stride)
+    b = np.frombuffer(bytes(new), dtype=np.uint8).reshape(height, stride)
+    diff = a != b
+    rows = np.flatnonzero(diff.any(axis=1))
+    if rows.size == 0:
+        return []
+
+    # Split the changed rows wherever there is a large enough unchanged gap
+    breaks = np.flatnonzero(np.diff(rows) > max_gap)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]]))
+
+    rects = []
+    for y0, y1 in zip(starts, ends):
+        cols = np.flatnonzero(diff[y0:y1 + 1].any(axis=0))
+        rects.append((int(cols[0]) * 8, int(y0), (int(cols[-1]) + 1) * 8, int(y1) + 1))
+    return rects
+
+
+def rect_area(rect):
+    x0, y0, x1, y1 = rect
+    return (x1 - x0) * (y1 - y0)
+
+
+class RefreshPlanner:
+    """Picks the cheapest refresh for each new 1-bit frame.
+
+    Keeps the last frame pushed to the panel and diffs the next one against
+    it: small changes use display_Partial, medium changes display_Fast and
+    large changes a full display_Base. Partial and fast refreshes leave
+    ghosting behind, so every full_every of them forces a full refresh.
+    """
+
+    def __init__(self, width, height, partial_max=0.15, fast_max=0.5, max_partial_rects=3, full_every=10,
+                 modes=(REFRESH_FULL, REFRESH_FAST, REFRESH_PARTIAL)):
+        self.width = width
+        self.height = height
+        self.partial_max = partial_max
+        self.fast_max = fast_max
+        self.max_partial_rects = max_partial_rects
+        self.full_every = full_every
+        # Refresh kinds the panel supports; full is always available
+        self.modes = set(modes)
+        self.last_frame = None
+        # display_Partial diffs against the controller's "old" RAM, which only
+        # display_Base (and Clear) write; a fast refresh leaves it stale
+        self.base_valid = False
+        self.ghosting_updates = 0
+
+    def invalidate(self):
+        """Forget what is on screen, e.g. after a 4-gray image or another process drew on it"""
+        self.last_frame = None
+        self.base_valid = False
+
+    def plan(self, frame):
+        """Return (refresh kind, rects) for showing frame"""
+        if self.last_frame is None:
+            return REFRESH_FULL, []
+        if self.modes == {REFRESH_FULL}:
+            # Nothing cheaper to choose, and on color panels the frame is not a 1-bit buffer
+            return (REFRESH_NONE if bytes(frame) == self.last_frame else REFRESH_FULL), []
+
+        rects = dirty_rects(self.last_frame, frame, self.width, self.height)
+        if not rects:
+            return REFRESH_NONE, []
+        if self.ghosting_updates >= self.full_every:
+            return REFRESH_FULL, []
+
+        total = self.width * self.height
+        changed = sum(rect_area(r) for r in rects) / total
+        if (REFRESH_PARTIAL in self.modes and self.base_valid and changed <= self.partial_max
+                and len(rects) <= self.max_partial_rects):
+            # One refresh of the bounding box beats several if it is still small
+            x0 = min(r[0] for r in rects)
+            y0 = min(r[1] for r in rects)
+            x1 = max(r[2] for r in rects)
+            y1 = max(r[3] for r in rects)
+            bounding = (x0, y0, x1, y1)
+            if rect_area(bounding) / total <= self.partial_max:
+                rects = [bounding]
+            return REFRESH_PARTIAL, rects
+        if REFRESH_FAST in self.modes and changed <= self.fast_max:
+            return REFRESH_FAST, []
+        return REFRESH_FULL, []
+
+    def commit(self, frame, kind):
+        """Record that frame is now on screen after a refresh of the given kind"""
+        self.last_frame = bytes(frame)
+        if kind == REFRESH_FULL:
+            self.base_valid = True
+            self.ghosting_updates = 0
+        elif kind == REFRESH_FAST:
+            self.base_valid = False
+            self.ghosting_updates += 1
+        elif kind == REFRESH_PARTIAL:
+            self.ghosting_updates += 1
+
+    def show(self, session, frame):
+        """Push a 1-bit frame using the cheapest refresh and return its kind"""
+        if session.already_showing('1bit', frame):
+            # Also true right after a restart, when we have no frame to diff
+            # against yet; the old-image RAM can't be trusted in that case
+            if self.last_frame is None:
+                self.last_frame = bytes(frame)
+            logger.info("Frame already on screen, skipping refresh")
+            return REFRESH_NONE
+
+        kind, rects = self.plan(frame)
+        if kind == REFRESH_NONE:
+            logger.info("Frame unchanged, skipping refresh")
+            return kind
+
+        if kind == REFRESH_PARTIAL:
+            for x0, y0, x1, y1 in rects:
+                logger.info(f"Partial refresh of ({x0}, {y0})-({x1}, {y1})")
+                session.show(MODE_PARTIAL, frame, x0, y0, x1, y1)
+        elif kind == REFRESH_FAST:
+            logger.info("Fast refresh")
+            session.show(MODE_FAST, frame)
+        else:
+            logger.info("Full refresh")
+            session.show(MODE_FULL, frame)
+
+        self.commit(frame, kind)
+        session.mark_showing('1bit', frame)
+        return kind
+
+    def white_frame(self):
+        return bytes([0xFF]) * ((self.width + 7) // 8 * self.height)
+
+    def cleared(self, session):
+        """Record that epd.Clear() has written white to both RAM banks"""
+        frame = self.white_frame()
+        self.commit(frame, REFRESH_FULL)
+        session.mark_showing('1bit', frame)
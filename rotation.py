@@ -0,0 +1,128 @@
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _stem(filename):
+    return os.path.splitext(filename)[0]
+
+
+class ShuffleBag:
+    """Random rotation through the gallery that shows every image once per round.
+
+    Each round is a shuffled list of the gallery's images, drawn from until it
+    is empty and then reshuffled. An image that is deleted mid-round is skipped
+    when its turn comes, one added mid-round is slipped in at a random place
+    among those still to come, and a new round never starts with the image
+    the previous one ended on, so nothing is shown twice in a row.
+    """
+
+    def __init__(self, gallery_index):
+        self.gallery_index = gallery_index
+        self.lock = threading.Lock()
+        # Stems still to be drawn this round; the next draw is the last one
+        self.bag = []
+        # Stems that are part of this round, drawn or not
+        self.round = set()
+        self.last = None
+        self.seen_entries = None
+
+    def _refill(self, entries):
+        stems = [_stem(entry.filename) for entry in entries]
+        random.shuffle(stems)
+        if len(stems) > 1 and stems[-1] == self.last:
+            stems[0], stems[-1] = stems[-1], stems[0]
+        self.bag = stems
+        self.round = set(stems)
+        logger.info(f"Random rotation: new round of {len(stems)} images")
+
+    def _add_new(self, entries):
+        """Put images added since the round started at random places among those to come"""
+        for entry in entries:
+            stem = _stem(entry.filename)
+            if stem not in self.round:
+                self.bag.insert(random.randint(0, len(self.bag)), stem)
+                self.round.add(stem)
+
+    def _next(self, pop):
+        entries = self.gallery_index.entries()
+        if entries is not self.seen_entries:
+            # The index hands out the same list until the gallery changes
+            self._add_new(entries)
+            self.seen_entries = entries
+        for _ in range(2):
+            while self.bag:
+                entry = self.gallery_index.get(self.bag[-1])
+                if entry is None:
+                    self.bag.pop()
+                    continue
+                if pop:
+                    self.last = self.bag.pop()
+                return entry
+            if not entries:
+                return None
+            self._refill(entries)
+        return None
+
+    def draw(self):
+        """Next GalleryEntry of the rotation, or None if the gallery is empty"""
+        with self.lock:
+            return self._next(pop=True)
+
+    def peek(self):
+        """The entry draw() will return next, without drawing it"""
+        with self.lock:
+            return self._next(pop=False)
+
+
+class FramePrefetcher:
+    """Prepares one panel buffer ahead of time on a background thread.
+
+    prefetch(path, mode) starts render(path, mode) and keeps the result in
+    memory; take() hands it over if it is for the same image and mode, waiting
+    for it if it is still being made, since finishing it is never slower than
+    starting again.
+    """
+
+    def __init__(self, render):
+        self.render = render
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.lock = threading.Lock()
+        # (path, mode, Future) of the frame being prepared
+        self.pending = None
+
+    def prefetch(self, path, mode):
+        with self.lock:
+            if self.pending and self.pending[:2] == (path, mode):
+                return
+            if self.pending:
+                # Nobody will take the frame it replaces; drop it if it hasn't started
+                self.pending[2].cancel()
+            logger.info(f"Prefetching {os.path.basename(path)} ({mode})")
+            self.pending = (path, mode, self.executor.submit(self.render, path, mode))
+
+    def take(self, path, mode):
+        """The prefetched buffer for path in mode, or None if it wasn't prefetched"""
+        with self.lock:
+            pending = self.pending
+            if not pending or pending[:2] != (path, mode):
+                return None
+            self.pending = None
+        try:
+            return pending[2].result()
+        except Exception as e:
+            logger.warning(f"Prefetch of {os.path.basename(path)} failed: {e}")
+            return None
+
+    def stop(self):
+        with self.lock:
+            pending, self.pending = self.pending, None
+        # Replaced prefetches were cancelled already, so only this one can still be
+        # queued; shutdown(cancel_futures=True) would need Python 3.9
+        if pending:
+            pending[2].cancel()
+        self.executor.shutdown(wait=False)
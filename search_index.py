@@ -0,0 +1,66 @@
+import logging
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def match_expression(query):
+    """FTS5 query matching every word of query as a prefix, e.g. 'owl fly' -> '"owl"* "fly"*'"""
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class SearchIndex:
+    """Full-text search over image descriptions (the prompts images were made from).
+
+    An in-memory SQLite FTS5 table mirrors the metadata store. Before each
+    search the store's version is checked, and only descriptions that were
+    added, edited or removed since the last search are re-indexed, whether
+    the change came from this process or from another one writing the file.
+    """
+
+    def __init__(self, store, path=':memory:'):
+        self.store = store
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS descriptions "
+                          "USING fts5(filename UNINDEXED, description, tokenize='porter unicode61')")
+        self.conn.execute("DELETE FROM descriptions")
+        # filename -> (rowid, description) of what is in the table
+        self.indexed = {}
+        self.version = None
+
+    def sync(self):
+        """Bring the table up to date with the metadata store"""
+        with self.lock:
+            version = self.store.version()
+            if version == self.version:
+                return
+            data = self.store.snapshot()
+            stale = [f for f, (_, description) in self.indexed.items() if data.get(f) != description]
+            added = [(f, d) for f, d in data.items() if f not in self.indexed or f in stale]
+            with self.conn:
+                self.conn.executemany("DELETE FROM descriptions WHERE rowid = ?",
+                                      [(self.indexed.pop(f)[0],) for f in stale])
+                for filename, description in added:
+                    if not isinstance(description, str):
+                        continue
+                    cursor = self.conn.execute("INSERT INTO descriptions (filename, description) VALUES (?, ?)",
+                                               (filename, description))
+                    self.indexed[filename] = (cursor.lastrowid, description)
+            self.version = version
+            if stale or added:
+                logger.info(f"Search index: {len(added)} descriptions indexed, {len(stale)} replaced or removed")
+
+    def search(self, query):
+        """Set of filenames whose description matches every word of query"""
+        expression = match_expression(query)
+        if not expression:
+            return set()
+        self.sync()
+        with self.lock:
+            rows = self.conn.execute("SELECT filename FROM descriptions WHERE descriptions MATCH ?",
+                                     (expression,)).fetchall()
+        return {filename for filename, in rows}
@@ -0,0 +1,164 @@
+import glob
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+# image_pipeline is one of the shared modules in examples/ next to this file;
+# add it here rather than relying on the importer to have set up sys.path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'examples'))
+import image_pipeline
+
+logger = logging.getLogger(__name__)
+
+# Leftovers of the older crop-then-resize pipeline: ai_hp_crop_<ts>.bmp, ai_hp_<ts>_crop.bmp, ...
+INTERMEDIATE_PATTERN = re.compile(r'^ai_(hp|custom)_.*crop.*\.(bmp|png|jpg|webp)$')
+
+
+def evictable(filename):
+    """Whether filename is a downloaded original or a generation intermediate.
+    Gallery images (the display-sized renditions) never are."""
+    return bool(INTERMEDIATE_PATTERN.match(filename)) or image_pipeline.resized_name(filename) is not None
+
+
+class StorageQuota:
+    """Keeps the images directory under a byte quota.
+
+    The directory is scanned once, and again at most every rescan_interval
+    seconds to pick up files written by other processes (the quiz); files
+    this process writes are reported with add(). When the total is over
+    the quota, downloaded originals and intermediates are deleted least
+    recently used first, together with the panel buffers packed from them.
+    Gallery images and anything named in the metadata (is_referenced) are
+    never deleted. Use is recorded by touch() as the file's atime, so the
+    order survives restarts and noatime mounts.
+    """
+
+    def __init__(self, images_dir, quota_bytes, cache_dir=None, is_referenced=None, rescan_interval=3600):
+        self.images_dir = images_dir
+        self.quota_bytes = quota_bytes
+        self.cache_dir = cache_dir
+        self.is_referenced = is_referenced or (lambda filename: False)
+        self.rescan_interval = rescan_interval
+        self.lock = threading.Lock()
+        # filename -> size of every file in the directory
+        self.sizes = {}
+        # filename -> last use, for the evictable ones
+        self.last_used = {}
+        self.total = 0
+        self.scanned = None
+        self.reclaimed = 0
+
+    def scan(self):
+        sizes = {}
+        last_used = {}
+        try:
+            with os.scandir(self.images_dir) as entries:
+                for entry in entries:
+                    try:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    sizes[entry.name] = st.st_size
+                    if evictable(entry.name):
+                        last_used[entry.name] = max(st.st_atime, st.st_mtime)
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            self.sizes = sizes
+            self.last_used = last_used
+            self.total = sum(sizes.values())
+            self.scanned = time.monotonic()
+        logger.info(f"Images use {self.total / 2**20:.1f} MB of {self.quota_bytes / 2**20:.0f} MB, "
+                    f"{len(last_used)} originals and intermediates can be evicted")
+
+    def add(self, path):
+        """Account for a file this process just wrote"""
+        if not path:
+            return
+        filename = os.path.basename(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        with self.lock:
+            self.total += st.st_size - self.sizes.get(filename, 0)
+            self.sizes[filename] = st.st_size
+            if evictable(filename):
+                self.last_used[filename] = time.time()
+
+    def touch(self, path):
+        """Record that an original was just used, so it is evicted last"""
+        filename = os.path.basename(path)
+        with self.lock:
+            if filename not in self.last_used:
+                return
+            now = time.time()
+            self.last_used[filename] = now
+        try:
+            os.utime(path, (now, os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    def usage(self):
+        with self.lock:
+            return {'used': self.total, 'quota': self.quota_bytes,
+                    'evictable': sum(self.sizes.get(f, 0) for f in self.last_used),
+                    'reclaimed': self.reclaimed}
+
+    def enforce(self):
+        """Evict least recently used originals and intermediates until under the quota.
+        Returns (bytes reclaimed, filenames evicted)."""
+        if self.scanned is None or time.monotonic() - self.scanned > self.rescan_interval:
+            self.scan()
+        reclaimed = 0
+        evicted = []
+        with self.lock:
+            if self.total <= self.quota_bytes:
+                return 0, []
+            for filename in sorted(self.last_used, key=self.last_used.get):
+                if self.total <= self.quota_bytes:
+                    break
+                if self.is_referenced(filename):
+                    continue
+                try:
+                    size = self._remove(filename)
+                except OSError as e:
+                    logger.error(f"Could not evict {filename}: {e}")
+                    continue
+                self.total -= self.sizes.pop(filename, 0)
+                del self.last_used[filename]
+                if size is not None:
+                    reclaimed += size
+                    evicted.append(filename)
+            self.reclaimed += reclaimed
+            over = self.total - self.quota_bytes
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} originals and intermediates, reclaimed {reclaimed / 2**20:.1f} MB")
+        if over > 0:
+            logger.warning(f"Images are still {over / 2**20:.1f} MB over the quota; "
+                           "only gallery images and described files are left")
+        return reclaimed, evicted
+
+    def _remove(self, filename):
+        """Delete filename and the panel buffers packed from it. Returns the bytes
+        freed, or None if it was already gone."""
+        path = os.path.join(self.images_dir, filename)
+        try:
+            size = os.stat(path).st_size
+            os.remove(path)
+        except FileNotFoundError:
+            return None
+        if self.cache_dir:
+            for cached in glob.glob(os.path.join(glob.escape(self.cache_dir), glob.escape(filename) + '.*.bin')):
+                try:
+                    size += os.stat(cached).st_size
+                    os.remove(cached)
+                except OSError:
+                    pass
+        logger.info(f"Evicted {filename}")
+        return size